@@ -1,2 +1,5 @@
 from .hdf5zarr import *
 from .nwbhdf5zarrio import *
+from .catalog import *
+from .references import *
+from .sidecar import *
@@ -0,0 +1,189 @@
+import sqlite3
+import json
+import time
+import zarr
+import numpy as np
+from pathlib import PurePosixPath
+from zarr.util import json_loads
+from .hdf5zarr import HDF5Zarr, chunks_meta_key, _path_to_prefix
+
+
+class SessionCatalog(object):
+    """ class to collect metadata of HDF5Zarr hierarchies of many files in an indexed SQLite database """
+
+    _schema = (
+        'CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, uri TEXT, indexed_at REAL)',
+        'CREATE TABLE IF NOT EXISTS groups (session_id TEXT, path TEXT, neurodata_type TEXT, '
+        'PRIMARY KEY (session_id, path))',
+        'CREATE TABLE IF NOT EXISTS datasets (session_id TEXT, path TEXT, neurodata_type TEXT, dtype TEXT, '
+        'shape TEXT, ndim INTEGER, nbytes INTEGER, storage_bytes INTEGER, nchunks INTEGER, '
+        'PRIMARY KEY (session_id, path))',
+        'CREATE TABLE IF NOT EXISTS attributes (session_id TEXT, path TEXT, name TEXT, value, '
+        'PRIMARY KEY (session_id, path, name))',
+        'CREATE TABLE IF NOT EXISTS dataset_values (session_id TEXT, path TEXT, row INTEGER, value, '
+        'PRIMARY KEY (session_id, path, row))',
+        'CREATE INDEX IF NOT EXISTS groups_type ON groups (neurodata_type)',
+        'CREATE INDEX IF NOT EXISTS datasets_path ON datasets (path)',
+        'CREATE INDEX IF NOT EXISTS attributes_name_value ON attributes (name, value)',
+        'CREATE INDEX IF NOT EXISTS dataset_values_path_value ON dataset_values (path, value)',
+    )
+
+    _tables = ('sessions', 'groups', 'datasets', 'attributes', 'dataset_values')
+
+    def __init__(self, filename: str, max_value_bytes: int = 2**16):
+        """
+        Args:
+            filename:                    str, SQLite database file, created if it does not exist.
+                                         ':memory:' creates a database in memory
+            max_value_bytes:             int, values of scalar and one-dimensional datasets up to this size
+                                         are stored in the dataset_values table, e.g. columns of units and
+                                         electrodes tables. default 64 KiB
+        """
+        if not isinstance(max_value_bytes, int):
+            raise TypeError(f"Expected int for max_value_bytes, recieved {type(max_value_bytes)}")
+        self.max_value_bytes = max_value_bytes
+        self.filename = filename
+        self.db = sqlite3.connect(filename)
+        with self.db:
+            for statement in self._schema:
+                self.db.execute(statement)
+
+    def add_session(self, source, session_id: str = None):
+        """ Add or replace the metadata of one file
+        Args:
+          source:       HDF5Zarr object or zarr.Group of an HDF5Zarr hierarchy
+          session_id:   str, identifier of the file in the catalog. default is the file name without extension
+        Returns:
+          str, session_id
+        """
+        if isinstance(source, HDF5Zarr):
+            zgroup = source.zgroup
+            uri = source.uri
+        elif isinstance(source, zarr.Group):
+            zgroup = source
+            uri = None
+        else:
+            raise TypeError(f"Expected HDF5Zarr or zarr.Group for source, recieved {type(source)}")
+
+        store = zgroup.store
+        prefix = _path_to_prefix(zgroup.path)
+        metadata = dict()
+        for key in store:
+            if key.startswith(prefix) and PurePosixPath(key).name in ('.zgroup', '.zarray', '.zattrs', chunks_meta_key):
+                metadata[key[len(prefix):]] = store[key]
+
+        def meta(key):
+            value = metadata[key]
+            return json_loads(value) if isinstance(value, bytes) else value
+
+        if uri is None:
+            for key in metadata:
+                if key.endswith(chunks_meta_key):
+                    uri = meta(key).get('source', {}).get('uri')
+                    break
+        if session_id is None:
+            if not uri:
+                raise ValueError("session_id is required, file name is not known")
+            session_id = PurePosixPath(uri).stem
+
+        groups = []
+        datasets = []
+        attributes = []
+        values = []
+        for key in sorted(metadata):
+            path = str(PurePosixPath(key).parent)
+            path = '' if path == '.' else path
+            name = PurePosixPath(key).name
+            if name == '.zattrs':
+                for attr_name, attr_value in meta(key).items():
+                    attributes.append((session_id, path, attr_name, self._sql_value(attr_value)))
+            elif name == '.zgroup':
+                neurodata_type = self._neurodata_type(meta, path)
+                groups.append((session_id, path, neurodata_type))
+            elif name == '.zarray':
+                zarray_meta = meta(key)
+                dtype = zarray_meta['dtype']
+                if isinstance(dtype, list):
+                    dtype = [tuple(el) for el in dtype]
+                dtype = np.dtype(dtype)
+                shape = tuple(zarray_meta['shape'])
+                nbytes = int(np.prod(shape))*dtype.itemsize
+                storage_bytes = None
+                nchunks = None
+                zchunks_key = _path_to_prefix(path) + chunks_meta_key
+                if zchunks_key in metadata:
+                    chunks_loc = {k: v for k, v in meta(zchunks_key).items() if k != 'source'}
+                    storage_bytes = sum(v['size'] for v in chunks_loc.values())
+                    nchunks = len(chunks_loc)
+                datasets.append((session_id, path, self._neurodata_type(meta, path),
+                                 self._sql_value(zarray_meta['dtype']), self._sql_value(list(shape)), len(shape),
+                                 nbytes, storage_bytes, nchunks))
+                if len(shape) <= 1 and dtype.names is None and nbytes <= self.max_value_bytes:
+                    values.extend(self._dataset_values(zgroup, session_id, path))
+
+        with self.db:
+            self._delete_session(session_id)
+            self.db.execute('INSERT INTO sessions VALUES (?, ?, ?)', (session_id, uri, time.time()))
+            self.db.executemany('INSERT INTO groups VALUES (?, ?, ?)', groups)
+            self.db.executemany('INSERT INTO datasets VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', datasets)
+            self.db.executemany('INSERT INTO attributes VALUES (?, ?, ?, ?)', attributes)
+            self.db.executemany('INSERT INTO dataset_values VALUES (?, ?, ?, ?)', values)
+
+        return session_id
+
+    def remove_session(self, session_id: str):
+        """ Remove the metadata of one file """
+        with self.db:
+            self._delete_session(session_id)
+
+    def _delete_session(self, session_id):
+        for table in self._tables:
+            self.db.execute(f'DELETE FROM {table} WHERE session_id = ?', (session_id,))
+
+    def query(self, sql: str, parameters=()):
+        """ Run a SQL query on the catalog
+        Args:
+          sql:          str, SQL statement on tables sessions, groups, datasets, attributes and dataset_values
+          parameters:   sequence or dict, query parameters
+        Returns:
+          list of row tuples
+        """
+        return self.db.execute(sql, parameters).fetchall()
+
+    def sessions(self):
+        """ List of session ids in the catalog """
+        return [row[0] for row in self.db.execute('SELECT session_id FROM sessions ORDER BY session_id')]
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @staticmethod
+    def _neurodata_type(meta, path):
+        try:
+            return meta(_path_to_prefix(path) + '.zattrs').get('neurodata_type')
+        except KeyError:
+            return None
+
+    @staticmethod
+    def _sql_value(value):
+        # sqlite stores numbers and strings as is, other values as json
+        if value is None or isinstance(value, (bool, int, float, str)):
+            return value
+        return json.dumps(value)
+
+    def _dataset_values(self, zgroup, session_id, path):
+        try:
+            data = zgroup[path][...]
+        except Exception:
+            print(f"Values of dataset {path} are not added to the catalog")
+            return []
+        data = np.atleast_1d(data)
+        if data.dtype.kind == 'S':
+            data = np.char.decode(data, 'utf-8')
+        return [(session_id, path, row, self._sql_value(value)) for row, value in enumerate(data.tolist())]
@@ -0,0 +1,194 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+import traceback
+import zarr
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from .hdf5zarr import HDF5Zarr, SQLiteMetadataStore
+
+
+def find_files(source: str, pattern: str = '*.nwb'):
+    """ Files to index
+    Args:
+      source:         str, directory, or manifest file listing one file per line. empty lines and lines starting
+                      with '#' are skipped, relative paths are relative to the manifest directory
+      pattern:        str, glob pattern of the files in a source directory, default '*.nwb'
+    Returns:
+      list of str, absolute file paths
+    """
+    source = Path(source)
+    if source.is_dir():
+        return sorted(str(path.resolve()) for path in source.glob(pattern) if path.is_file())
+    files = []
+    with open(source) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                files.append(str((source.parent / line).resolve()))
+    return files
+
+
+def read_status(status_file: str):
+    """ Last status record of each file in a status file
+    Args:
+      status_file:    str, json lines file written by main
+    Returns:
+      dict mapping file paths to status records
+    """
+    status = dict()
+    try:
+        with open(status_file) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # line of an interrupted write
+                    continue
+                status[record['file']] = record
+    except FileNotFoundError:
+        pass
+    return status
+
+
+def index_file(filename: str, out: str, store_format: str = 'sqlite', sharded: bool = False, **kwargs):
+    """ Create the HDF5Zarr hierarchy of a file and consolidate its metadata into an output store. The store is
+    written under a temporary name and renamed when complete, an existing store is replaced.
+    Args:
+      filename:       str, hdf5 file
+      out:            str, output store path
+      store_format:   str, 'sqlite', SQLiteMetadataStore file, or 'zarr', zarr.DirectoryStore directory
+      sharded:        bool, see HDF5Zarr.consolidate_metadata
+      kwargs:         passed to HDF5Zarr
+    Returns:
+      dict, status record with file, store, status 'ok' or 'error', seconds, and error and traceback on error
+    """
+    record = {'file': filename, 'store': out, 'status': 'ok', 'seconds': None, 'error': None, 'traceback': None}
+    start = time.perf_counter()
+    tmp = os.path.join(os.path.dirname(out), '.' + os.path.basename(out) + '.tmp')
+    store = None
+    try:
+        _remove(tmp)
+        store = SQLiteMetadataStore(tmp) if store_format == 'sqlite' else zarr.DirectoryStore(tmp)
+        hdf5_zarr = HDF5Zarr(filename, store=store, store_mode='w', **kwargs)
+        try:
+            hdf5_zarr.consolidate_metadata(sharded=sharded)
+        finally:
+            hdf5_zarr.close()
+        if store_format == 'sqlite':
+            store.close()
+        _remove(out)
+        os.replace(tmp, out)
+    except Exception as e:
+        record.update(status='error', error=f'{type(e).__name__}: {e}', traceback=traceback.format_exc())
+        if store_format == 'sqlite' and store is not None:
+            store.close()
+        _remove(tmp)
+    record['seconds'] = round(time.perf_counter() - start, 3)
+    return record
+
+
+def _remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def main(argv=None):
+    """ Index a directory or manifest of hdf5 files in a process pool. The status of each file is appended to a
+    json lines status file as it completes, files already indexed are skipped when the command is run again.
+    Returns:
+      int, exit code, 1 if any file failed, 2 if files have the same store name
+    """
+    parser = argparse.ArgumentParser(
+        prog='hdf5zarr-index',
+        description="Create HDF5Zarr hierarchies of hdf5 files and write each file's consolidated metadata "
+                    "to an output store. Interrupted runs resume with the files not indexed yet.")
+    parser.add_argument('source', help="directory of files, or manifest file listing one file per line")
+    parser.add_argument('-o', '--output', required=True, help="output directory of the stores")
+    parser.add_argument('--pattern', default='*.nwb',
+                        help="glob pattern of files in a source directory, default '*.nwb'")
+    parser.add_argument('--format', default='sqlite', choices=('sqlite', 'zarr'),
+                        help="store format, 'sqlite', one <name>.sqlite file per file, or 'zarr', "
+                             "one <name>.zarr directory per file. default 'sqlite'")
+    parser.add_argument('-p', '--processes', type=int, default=os.cpu_count() or 1,
+                        help="number of processes, default number of cpus")
+    parser.add_argument('--status', default=None, help="status file, default <output>/status.jsonl")
+    parser.add_argument('--retry-failed', action='store_true', help="index files that failed in previous runs")
+    parser.add_argument('--force', action='store_true', help="index all files, including indexed files")
+    parser.add_argument('--sharded', action='store_true', help="shard consolidated metadata by top-level group")
+    parser.add_argument('--max-chunksize', type=int, default=2*2**20, help="see HDF5Zarr max_chunksize")
+    parser.add_argument('--inline-threshold', type=int, default=0, help="see HDF5Zarr inline_threshold")
+    parser.add_argument('--chunk-stats', action='store_true', help="see HDF5Zarr chunk_stats")
+    parser.add_argument('--interval-index', action='store_true', help="see HDF5Zarr interval_index")
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.output, exist_ok=True)
+    status_file = args.status or os.path.join(args.output, 'status.jsonl')
+    status = read_status(status_file)
+
+    files = find_files(args.source, args.pattern)
+    extension = '.sqlite' if args.format == 'sqlite' else '.zarr'
+    stores = {filename: os.path.join(os.path.abspath(args.output), Path(filename).stem + extension)
+              for filename in files}
+    # stores are named by file name, files with the same name in different directories would overwrite each other
+    names = dict()
+    for filename in files:
+        names.setdefault(Path(filename).stem, []).append(filename)
+    collisions = {name: filenames for name, filenames in names.items() if len(filenames) > 1}
+    if collisions:
+        for name, filenames in sorted(collisions.items()):
+            print(f"store name '{name}{extension}' of files: " + ', '.join(filenames))
+        print("files with the same name can not be indexed in one output directory, "
+              "index them to separate output directories")
+        return 2
+    todo = []
+    for filename in files:
+        record = status.get(filename)
+        if args.force or record is None or (record['status'] == 'ok' and not os.path.exists(stores[filename])):
+            todo.append(filename)
+        elif record['status'] == 'error' and args.retry_failed:
+            todo.append(filename)
+    print(f"{len(files)} files, {len(files) - len(todo)} skipped, {len(todo)} to index")
+
+    options = dict(store_format=args.format, sharded=args.sharded, max_chunksize=args.max_chunksize,
+                   inline_threshold=args.inline_threshold, chunk_stats=args.chunk_stats,
+                   interval_index=args.interval_index)
+    failed = 0
+    with open(status_file, 'a') as f:
+        def write(i, record):
+            nonlocal failed
+            record['session'] = Path(record['file']).stem
+            record['finished'] = time.time()
+            f.write(json.dumps(record) + '\n')
+            f.flush()
+            failed += record['status'] != 'ok'
+            print(f"[{i}/{len(todo)}] {record['file']} {record['status']} {record['seconds']}s"
+                  + (f" {record['error']}" if record['error'] else ''))
+
+        if args.processes <= 1:
+            for i, filename in enumerate(todo, 1):
+                write(i, index_file(filename, stores[filename], **options))
+        else:
+            with ProcessPoolExecutor(max_workers=args.processes) as executor:
+                futures = {executor.submit(index_file, filename, stores[filename], **options): filename
+                           for filename in todo}
+                for i, future in enumerate(as_completed(futures), 1):
+                    try:
+                        record = future.result()
+                    except Exception as e:
+                        # the process running the file died
+                        filename = futures[future]
+                        record = {'file': filename, 'store': stores[filename], 'status': 'error', 'seconds': None,
+                                  'error': f'{type(e).__name__}: {e}', 'traceback': None}
+                    write(i, record)
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
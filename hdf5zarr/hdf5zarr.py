@@ -2,6 +2,7 @@ import h5py
 import zarr
 from zarr.storage import array_meta_key
 from zarr.storage import ConsolidatedMetadataStore
+from zarr.errors import ReadOnlyError
 import numpy as np
 from urllib.parse import urlparse, urlunparse
 import numcodecs
@@ -11,11 +12,25 @@ import os
 import io
 from pathlib import Path
 from collections.abc import MutableMapping
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import threading
+import weakref
+import uuid
 from pathlib import PurePosixPath
 from zarr.util import json_dumps, json_loads
+from numcodecs.compat import ensure_bytes, ensure_contiguous_ndarray
 from xdrlib import Unpacker
 import struct
+try:
+    # zarr >= 2.11 wraps stores that are not BaseStore instances, hiding getitems
+    from zarr.storage import BaseStore as _BaseStore
+except ImportError:
+    _BaseStore = MutableMapping
 SYMLINK = '.link'
+# attribute listing the object references of a zarr object, see HDF5Zarr.copy_attrs_data_to_zarr_store
+REFERENCES = '.references'
 
 
 class UnpackerVlenString(Unpacker):
@@ -117,7 +132,8 @@ class HDF5Zarr(object):
     def __init__(self, filename: str, hdf5group: str = None, hdf5file_mode: str = 'r',
                  store: Union[MutableMapping, str, Path] = None, store_path: str = None,
                  store_mode: str = 'a', LRU: bool = False, LRU_max_size: int = 2**30,
-                 max_chunksize=2*2**20):
+                 max_chunksize=2*2**20, prefetch: int = 0, decode_workers: int = 0, inline_threshold: int = 0,
+                 chunk_stats: bool = False, interval_index: bool = False):
 
         """
         Args:
@@ -129,7 +145,9 @@ class HDF5Zarr(object):
                                          'r+'         read and write
             store:                       collections.abc.MutableMapping or str, zarr store.
                                          if string path is passed, zarr.DirectoryStore
-                                         is created at the given path, if None, zarr.MemoryStore is used
+                                         is created at the given path, or SQLiteMetadataStore
+                                         if the path ends with '.sqlite' or '.db'.
+                                         if None, zarr.MemoryStore is used
             store_mode:                  store data access mode, default 'a'
                                          'r'          readonly, compatible zarr hierarchy should
                                                       already exist in the passed store
@@ -145,6 +163,21 @@ class HDF5Zarr(object):
                                          if store is zarr.LRUStoreCache, or LRU argument is True
             max_chunksize:               maximum chunk size to use when creating zarr hierarchy, this is useful if
                                          only a small slice of data needs to be read
+            prefetch:                    int, number of chunks FileChunkStore reads ahead on a background thread
+                                         when an array is read sequentially, default 0, disabled
+            decode_workers:              int, if not 0, FileChunkStore decompresses chunks of compressed arrays instead
+                                         of zarr, using decode_workers threads for selections spanning several chunks.
+                                         default 0, chunks are decompressed by zarr one after another
+            inline_threshold:            int, datasets stored in up to inline_threshold bytes in hdf5 file, e.g. scalar
+                                         metadata, are copied to the store as zarr chunks when creating zarr hierarchy,
+                                         so that reading them needs no file reads. default 0, disabled
+            chunk_stats:                 bool, when creating zarr hierarchy, store minimum, maximum and number of
+                                         elements of each chunk of one-dimensional numeric datasets that are sorted,
+                                         e.g. timestamps, for HDF5Zarr.time_range. default False
+            interval_index:              bool, when creating zarr hierarchy, store an index of the intervals of groups
+                                         with start_time and stop_time datasets, e.g. intervals tables,
+                                         for HDF5Zarr.find_intervals. the index is not part of consolidated
+                                         metadata. default False
         """
         # Verify arguments
         if hdf5file_mode not in ('r', 'r+'):
@@ -161,10 +194,29 @@ class HDF5Zarr(object):
         if not isinstance(max_chunksize, int):
             raise TypeError(f"Expected int for max_chunksize, recieved {type(max_chunksize)}")
         self.max_chunksize = max_chunksize
+        if not isinstance(prefetch, int):
+            raise TypeError(f"Expected int for prefetch, recieved {type(prefetch)}")
+        self.prefetch = prefetch
+        if not isinstance(decode_workers, int):
+            raise TypeError(f"Expected int for decode_workers, recieved {type(decode_workers)}")
+        self.decode_workers = decode_workers
+        if not isinstance(inline_threshold, int):
+            raise TypeError(f"Expected int for inline_threshold, recieved {type(inline_threshold)}")
+        self.inline_threshold = inline_threshold
+        if not isinstance(chunk_stats, bool):
+            raise TypeError(f"Expected bool for chunk_stats, recieved {type(chunk_stats)}")
+        self.chunk_stats = chunk_stats
+        if not isinstance(interval_index, bool):
+            raise TypeError(f"Expected bool for interval_index, recieved {type(interval_index)}")
+        self.interval_index = interval_index
 
         # store, store_path, and store_mode are passed through to zarr
         self.store_path = store_path
         self.store_mode = store_mode
+        if isinstance(store, str) and store.endswith(('.sqlite', '.db')):
+            store = SQLiteMetadataStore(store)
+        elif isinstance(store, str):
+            store = zarr.storage.normalize_store_arg(store, mode=store_mode)
         if store is not None and LRU is True and not isinstance(store, zarr.LRUStoreCache):
             self.store = zarr.LRUStoreCache(store, max_size=self.LRU_max_size)
         else:
@@ -176,6 +228,11 @@ class HDF5Zarr(object):
 
         # dictionary to hold addresses of hdf5 objects in file
         self._address_dict = {}
+        # parsed interval indexes, by group path, and address index
+        self._interval_indexes = {}
+        self._address_index = None
+        # arguments of the last consolidate_metadata call
+        self._consolidated = None
 
         # create zarr format hierarchy for datasets and attributes compatible with hdf5 file,
         # dataset contents are not copied, unless it contains variable-length strings
@@ -202,55 +259,1013 @@ class HDF5Zarr(object):
         self.filename = filename
         if self.store_mode != 'r':
             self.file = h5py.File(self.filename, mode=self.hdf5file_mode)
-            self.group = self.file[self.hdf5group] if self.hdf5group is not None else self.file
-            self.create_zarr_hierarchy(self.group, self.zgroup)
-            self.file.close()
+            try:
+                self.group = self.file[self.hdf5group] if self.hdf5group is not None else self.file
+                with _transaction(self.store):
+                    self.create_zarr_hierarchy(self.group, self.zgroup)
+                    self._store_address_index()
+            finally:
+                self.file.close()
         if isinstance(self.filename, str):
+            # the chunk store opens the file on first read
             self.chunkstore_file = fsspec.open(self.filename, mode='rb')
-            self.chunk_store = FileChunkStore(self.store, chunk_source=self.chunkstore_file.open())
+            self.chunk_store = FileChunkStore(self.store, uri=self.chunkstore_file.path, fs=self.chunkstore_file.fs,
+                                              prefetch=self.prefetch, decode_workers=self.decode_workers)
         else:
-            self.chunk_store = FileChunkStore(self.store, chunk_source=self.filename)
+            self.chunk_store = FileChunkStore(self.store, chunk_source=self.filename,
+                                              prefetch=self.prefetch, decode_workers=self.decode_workers)
         if LRU is True and not isinstance(self.chunk_store, zarr.LRUStoreCache):
             self.chunk_store = zarr.LRUStoreCache(self.chunk_store, max_size=self.LRU_max_size)
 
         # open zarr group
+        self.zgroup = self._open_zgroup()
+
+    # options pickled with HDF5Zarr, metadata and indexes are read again from the store
+    _pickled_options = ('hdf5file_mode', 'LRU', 'LRU_max_size', 'max_chunksize', 'prefetch', 'decode_workers',
+                        'inline_threshold', 'chunk_stats', 'interval_index', 'store_path', 'store_mode', 'uri',
+                        'hdf5group', '_consolidated')
+
+    def __getstate__(self):
+        """ Pickle as a reference to the store, the chunk store and options. The hierarchy is opened again on first
+        access to zgroup, the chunk store reopens the file lazily. Requires a store with a location, see
+        FileChunkStore.
+        """
+        chunk_store = self.chunk_store
+        if isinstance(chunk_store, zarr.LRUStoreCache):
+            chunk_store = chunk_store._store
+        state = {name: getattr(self, name) for name in self._pickled_options}
+        state['store'] = _store_reference(self.store)
+        state['chunk_store'] = chunk_store
+        state['filename'] = self.filename if isinstance(self.filename, str) else self.uri
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.LRU and not isinstance(self.store, zarr.LRUStoreCache):
+            self.store = zarr.LRUStoreCache(self.store, max_size=self.LRU_max_size)
+        if self.LRU:
+            self.chunk_store = zarr.LRUStoreCache(self.chunk_store, max_size=self.LRU_max_size)
+        self._hdf5_regfilters_subset = {}
+        self._fill_regfilters()
+        self._address_dict = {}
+        self._interval_indexes = {}
+        self._address_index = None
+        self._zgroup = None
+
+    @property
+    def zgroup(self):
+        """ zarr.Group of the hierarchy, opened with consolidated metadata after consolidate_metadata """
+        if self._zgroup is None:
+            self._zgroup = self._open_zgroup()
+        return self._zgroup
+
+    @zgroup.setter
+    def zgroup(self, zgroup):
+        self._zgroup = zgroup
+
+    def _open_zgroup(self):
+        store = self.store
+        if self._consolidated is not None:
+            if self._consolidated['sharded']:
+                store = ShardedConsolidatedMetadataStore(store, metadata_key=self._consolidated['metadata_key'])
+            else:
+                store = ConsolidatedMetadataStore(store, metadata_key=self._consolidated['metadata_key'])
         store_mode_cons = 'r' if self.store_mode == 'r' else 'r+'
-        self.zgroup = zarr.open_group(self.store, mode=store_mode_cons, path=self.store_path, chunk_store=self.chunk_store)
+        return zarr.open_group(self._decoded_view(store), mode=store_mode_cons, path=self.store_path,
+                               chunk_store=self.chunk_store)
+
+    def close(self):
+        """ Close the chunk store, stopping its threads and closing the hdf5 file opened by the chunk store.
+        The file is reopened on the next read, file-like objects passed as filename are not closed.
+        """
+        chunk_store = self.chunk_store
+        if isinstance(chunk_store, zarr.LRUStoreCache):
+            chunk_store = chunk_store._store
+        chunk_store.close()
 
-    def consolidate_metadata(self, metadata_key='.zmetadata'):
+    def consolidate_metadata(self, metadata_key='.zmetadata', sharded: bool = False, read_workers: int = 8):
         '''
         Wrapper over zarr.consolidate_metadata to pass chunk store when opening the zarr store
+        Args:
+          metadata_key:   str, key of the consolidated metadata document
+          sharded:        bool, if True, the metadata of each top-level group is written to its own document
+                          '<group>/<metadata_key>', listed in the root document and read on first access
+                          to the group by ShardedConsolidatedMetadataStore. default False
+          read_workers:   int, number of threads reading metadata documents, default 8
+        Returns:
+          zarr.Group opened with the consolidated metadata
         '''
+        if not isinstance(sharded, bool):
+            raise TypeError(f"Expected bool for sharded, recieved {type(sharded)}")
+        if not isinstance(read_workers, int):
+            raise TypeError(f"Expected int for read_workers, recieved {type(read_workers)}")
 
         # same as zarr.consolidate_metadata(self.store, metadata_key) call,
         # only with key.endswith('.zchunkstore') in is_zarr_key, and passing chunk store
         def is_zarr_key(key):
-            return (key.endswith('.zchunkstore') or
-                    key.endswith('.zarray') or
-                    key.endswith('.zgroup') or
-                    key.endswith('.zattrs'))
-
-        out = {
-            'zarr_consolidated_format': 1,
-            'metadata': {
-                key: json_loads(self.store[key])
-                for key in self.store if is_zarr_key(key)
-            }
-        }
-        self.store[metadata_key] = json_dumps(out)
-
-        meta_store = ConsolidatedMetadataStore(self.store, metadata_key=metadata_key)
+            return key.endswith(_metadata_names)
 
-        store_mode_cons = 'r' if self.store_mode == 'r' else 'r+'
-        self.zgroup = zarr.open(store=meta_store, mode=store_mode_cons,
-                                chunk_store=self.zgroup.chunk_store, path=self.store_path)
+        if isinstance(self.store, SQLiteMetadataStore):
+            # all metadata documents in one query
+            items = dict(self.store.metadata_items())
+            keys = list(items)
+        else:
+            items = None
+            keys = [key for key in self.store if is_zarr_key(key)]
+
+        # one shard per top-level group of the hierarchy
+        prefix = _path_to_prefix(self.zgroup.path)
+        shard_paths = set()
+        if sharded:
+            for key in keys:
+                parts = key[len(prefix):].split('/')
+                if key.startswith(prefix) and len(parts) == 2 and parts[1] == '.zgroup':
+                    shard_paths.add(prefix + parts[0])
+        shards = {path: [] for path in shard_paths}
+        shards[''] = []
+        for key in keys:
+            path = prefix + key[len(prefix):].split('/', 1)[0]
+            shards[path if key.startswith(prefix) and path in shard_paths else ''].append(key)
+
+        def load(key):
+            return json_loads(items[key] if items is not None else self.store[key])
+
+        executor = ThreadPoolExecutor(max_workers=read_workers) if read_workers > 1 else None
+        try:
+            # documents are read and written one shard at a time
+            for path in sorted(shards, reverse=True):
+                shard_keys = shards[path]
+                values = executor.map(load, shard_keys) if executor is not None else map(load, shard_keys)
+                out = {
+                    'zarr_consolidated_format': 1,
+                    'metadata': dict(zip(shard_keys, values))
+                }
+                if path:
+                    self.store[path + '/' + metadata_key] = json_dumps(out)
+                else:
+                    if sharded:
+                        out['shards'] = sorted(shard_paths)
+                    self.store[metadata_key] = json_dumps(out)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        self._consolidated = {'metadata_key': metadata_key, 'sharded': sharded, 'read_workers': read_workers}
+        self.zgroup = self._open_zgroup()
 
         return self.zgroup
 
+    def _decoded_view(self, store):
+        # in decode mode, FileChunkStore decompresses chunks and zarr must not
+        return DecodedMetadataStore(store) if self.decode_workers else store
+
+    def _get_zarray(self, path):
+        zarray = self.zgroup[path]
+        if not isinstance(zarray, zarr.Array):
+            raise TypeError(f"{path} is not a dataset")
+        return zarray
+
+    @staticmethod
+    def _chunk_locations(zarray):
+        """ Read chunk location metadata of a zarr array
+        Args:
+          zarray:     zarr.Array
+        Returns:
+          dict mapping chunk index tuple to chunk location information, empty if the array
+          has no chunk location metadata
+        """
+        try:
+            zchunks = zarray.store[_path_to_prefix(zarray.path) + chunks_meta_key]
+        except KeyError:
+            return dict()
+        if isinstance(zchunks, bytes):
+            zchunks = json_loads(zchunks)
+
+        separator = getattr(zarray, '_dimension_separator', None) or '.'
+        locations = dict()
+        for k, v in zchunks.items():
+            if k == 'source':
+                continue
+            chunk_index = PurePosixPath(k).name
+            locations[tuple(int(i) for i in chunk_index.split(separator))] = v
+        return locations
+
+    def iter_blocks(self, path: str, axis: int = 0, block_bytes: int = 64*2**20):
+        """ Iterate over a dataset in chunk-aligned blocks along one axis, in file order.
+        The next block is read and decoded on a background thread while the caller processes the current one,
+        so at most two blocks are held in memory.
+        Args:
+          path:           str, path of the dataset in the zarr hierarchy
+          axis:           int, axis along which the dataset is split into blocks, default 0
+          block_bytes:    int, target size of a block in bytes, rounded down to whole chunks along axis,
+                          a block is at least one chunk wide. default 64 MiB
+        Yields:
+          tuple (slice, numpy.ndarray), selection along axis and the block data
+        """
+        zarray = self._get_zarray(path)
+        if zarray.ndim == 0:
+            raise ValueError(f"{path}: cannot iterate over a scalar dataset")
+        if not -zarray.ndim <= axis < zarray.ndim:
+            raise ValueError(f"axis {axis} is out of bounds for dataset {path} of dimension {zarray.ndim}")
+        axis = axis % zarray.ndim
+        if not isinstance(block_bytes, int):
+            raise TypeError(f"Expected int for block_bytes, recieved {type(block_bytes)}")
+
+        axis_len = zarray.shape[axis]
+        chunk_len = zarray.chunks[axis]
+        slab_bytes = chunk_len*int(np.prod(zarray.shape[:axis]+zarray.shape[axis+1:]))*zarray.dtype.itemsize
+        block_len = chunk_len*max(1, block_bytes//max(slab_bytes, 1))
+        starts = list(range(0, axis_len, block_len))
+
+        # order blocks by the first file offset of their chunks
+        locations = self._chunk_locations(zarray)
+        if locations:
+            block_offsets = dict()
+            for chunk_index, loc in locations.items():
+                start = chunk_index[axis]*chunk_len//block_len*block_len
+                block_offsets[start] = min(block_offsets.get(start, loc['offset']), loc['offset'])
+            starts.sort(key=lambda start: block_offsets.get(start, -1))
+
+        def read_block(start):
+            sel = slice(start, min(start+block_len, axis_len))
+            selection = (slice(None),)*axis + (sel,)
+            return sel, zarray[selection]
+
+        if not starts:
+            return
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix='HDF5Zarr-iter_blocks') as executor:
+            future = executor.submit(read_block, starts[0])
+            for start in starts[1:]:
+                block = future.result()
+                future = executor.submit(read_block, start)
+                yield block
+            yield future.result()
+
+    def to_dask(self, path: str, block_bytes: int = 128*2**20):
+        """ Create a dask array for a dataset, with dask chunks made of physically adjacent zarr chunks.
+        Consecutive rows of chunks along the first axis are grouped into one dask chunk while they are contiguous
+        in the file and the dask chunk stays below block_bytes, so each task reads its chunks at once.
+        Tasks read without a dask lock, also with prefetch and decode_workers, and the chunk store reads the file
+        at chunk offsets without a lock, so the tasks of the threaded scheduler read in parallel. The process and
+        distributed schedulers pickle the chunk store, which requires a metadata store with a location, see
+        FileChunkStore.
+        Args:
+          path:           str, path of the dataset in the zarr hierarchy
+          block_bytes:    int, maximum size in bytes of a dask chunk, a dask chunk is at least one row of chunks.
+                          default 128 MiB
+        Returns:
+          dask.array.Array
+        """
+        try:
+            import dask.array as da
+            from dask.base import tokenize
+        except ImportError:
+            raise ImportError("to_dask requires dask, install it with 'pip install dask[array]'")
+
+        zarray = self._get_zarray(path)
+        if not isinstance(block_bytes, int):
+            raise TypeError(f"Expected int for block_bytes, recieved {type(block_bytes)}")
+        if zarray.ndim == 0:
+            return da.from_array(zarray, chunks=(), lock=False, name=f'hdf5zarr-{tokenize(self.uri, zarray.path)}')
+
+        chunk_len = zarray.chunks[0]
+        n_rows = int(np.ceil(zarray.shape[0]/chunk_len)) if zarray.shape[0] else 0
+        row_bytes = chunk_len*int(np.prod(zarray.shape[1:]))*zarray.dtype.itemsize
+
+        # file extent of each row of chunks along the first axis
+        locations = self._chunk_locations(zarray)
+        row_start = dict()
+        row_stop = dict()
+        for chunk_index, loc in locations.items():
+            row = chunk_index[0]
+            row_start[row] = min(row_start.get(row, loc['offset']), loc['offset'])
+            row_stop[row] = max(row_stop.get(row, 0), loc['offset'] + loc['size'])
+
+        block_rows = []
+        for row in range(n_rows):
+            if block_rows:
+                prev = row - 1
+                adjacent = (prev in row_stop and row in row_start and
+                            0 <= row_start[row] - row_stop[prev] <= FileChunkStore._coalesce_gap)
+                if not locations:
+                    # chunks not in the hdf5 file, group by size only
+                    adjacent = True
+                if adjacent and (block_rows[-1] + 1)*row_bytes <= block_bytes:
+                    block_rows[-1] += 1
+                    continue
+            block_rows.append(1)
+
+        axis_chunks = [n*chunk_len for n in block_rows]
+        if axis_chunks:
+            axis_chunks[-1] -= n_rows*chunk_len - zarray.shape[0]
+        chunks = (tuple(axis_chunks),) + tuple((n,) for n in zarray.shape[1:])
+        name = f'hdf5zarr-{tokenize(self.uri, zarray.path, chunks)}'
+        # no dask lock: FileChunkStore serializes seek and read on the file, and its read-ahead
+        # and decode bookkeeping, so tasks read concurrently on the threaded scheduler
+        return da.from_array(zarray, chunks=chunks, lock=False, fancy=False, name=name)
+
+    def time_range(self, path: str, start=None, stop=None):
+        """ Find the elements of a sorted one-dimensional dataset, e.g. timestamps, within [start, stop).
+        With chunk statistics, see chunk_stats argument, the chunks holding start and stop are found from
+        the statistics and only those chunks are read, otherwise they are found by bisection over chunks.
+        Args:
+          path:           str, path of the dataset in the zarr hierarchy
+          start:          number, lower bound, default no lower bound
+          stop:           number, upper bound, excluded, default no upper bound
+        Returns:
+          slice, elements of the dataset within [start, stop), e.g. for selecting the matching rows of a data dataset
+        """
+        zarray = self._get_zarray(path)
+        if zarray.ndim != 1:
+            raise ValueError(f"{path}: time_range requires a one-dimensional dataset")
+        try:
+            stats = zarray.store[_path_to_prefix(zarray.path) + chunkstats_meta_key]
+        except KeyError:
+            stats = None
+
+        chunk_len = zarray.chunks[0]
+        chunks = dict()
+
+        def read_chunk(chunk):
+            if chunk not in chunks:
+                chunks[chunk] = zarray[chunk*chunk_len:(chunk+1)*chunk_len]
+            return chunks[chunk]
+
+        if stats is None:
+            n_chunks = -(-zarray.shape[0]//chunk_len)
+
+            def search(value):
+                # chunks before lo start below value
+                lo, hi = 0, n_chunks
+                while lo < hi:
+                    mid = (lo + hi)//2
+                    if read_chunk(mid)[0] < value:
+                        lo = mid + 1
+                    else:
+                        hi = mid
+                if lo == 0:
+                    return 0
+                return (lo - 1)*chunk_len + int(np.searchsorted(read_chunk(lo - 1), value, side='left'))
+        else:
+            if isinstance(stats, bytes):
+                stats = json_loads(stats)
+            chunk_max = np.asarray(stats['max'])
+
+            def search(value):
+                # first chunk with elements not below value
+                chunk = int(np.searchsorted(chunk_max, value, side='left'))
+                if chunk == len(chunk_max):
+                    return zarray.shape[0]
+                return chunk*chunk_len + int(np.searchsorted(read_chunk(chunk), value, side='left'))
+
+        i_start = 0 if start is None else search(start)
+        i_stop = zarray.shape[0] if stop is None else max(i_start, search(stop))
+        return slice(i_start, i_stop)
+
+    def find_intervals(self, path: str, start, stop=None):
+        """ Find the rows of a group with start_time and stop_time datasets, e.g. an intervals table,
+        overlapping a time range or containing a time point. With an interval index, see interval_index argument,
+        only the index is read, once, otherwise the start_time and stop_time datasets are read.
+        With the index, the rows checked are those starting before the end of the range and after the last row
+        whose stop time, and the stop times of all rows starting before it, are before the start of the range.
+        A query takes O(log n + m) for m such rows, m is the number of overlapping rows for intervals of similar
+        lengths, and up to the number of rows starting before the range if a long interval starts early.
+        Args:
+          path:           str, path of the group in the zarr hierarchy, e.g. 'intervals/trials'
+          start:          number, start of the time range, or the time point if stop is None
+          stop:           number, end of the time range. rows with start_time < stop and stop_time > start are
+                          returned. default None, rows with start_time <= start < stop_time are returned
+        Returns:
+          numpy.ndarray of int, sorted row numbers, for selecting the rows of the columns of the group
+        """
+        group = self.zgroup[path]
+        if not isinstance(group, zarr.Group):
+            raise TypeError(f"{path} is not a group")
+        index = self._interval_index(group)
+
+        if index is None:
+            row_start = group['start_time'][:]
+            row_stop = group['stop_time'][:]
+            if stop is None:
+                rows = (row_start <= start) & (row_stop > start)
+            else:
+                rows = (row_start < stop) & (row_stop > start)
+            return np.nonzero(rows)[0]
+
+        row_start, row_stop, max_stop, order = index
+        # rows starting before the end of the range, and not all ending before its start
+        if stop is None:
+            last = np.searchsorted(row_start, start, side='right')
+        else:
+            last = np.searchsorted(row_start, stop, side='left')
+        first = np.searchsorted(max_stop, start, side='right')
+        if first >= last:
+            return np.array([], dtype='int64')
+        candidates = np.arange(first, last)
+        candidates = candidates[row_stop[first:last] > start]
+        return np.sort(order[candidates])
+
+    def _interval_index(self, group):
+        """ Interval index of a group as arrays of start times, stop times, running maximum of stop times and row
+        numbers, ordered by start time, parsed once. None if the group has no interval index
+        """
+        index = self._interval_indexes.get(group.path)
+        if index is None:
+            try:
+                # read from the store, the index is not in consolidated metadata
+                index = self.store[_path_to_prefix(group.path) + intervals_meta_key]
+            except KeyError:
+                return None
+            if isinstance(index, bytes):
+                index = json_loads(index)
+            index = (np.asarray(index['start']), np.asarray(index['stop']), np.asarray(index['max_stop']),
+                     np.asarray(index['order'], dtype='int64'))
+            self._interval_indexes[group.path] = index
+        return index
+
+    def event_windows(self, path: str, events, window, timestamps: str = None, rate: float = None,
+                      starting_time: float = None, fill_value=None, block_bytes: int = 64*2**20):
+        """ Read windows of a dataset around many events, e.g. LFP around stimulus onsets, in one pass.
+        Event times are mapped to samples along the first axis, the chunks covering all windows are read once
+        in file order, in blocks of adjacent chunks, and copied into the output.
+        Args:
+          path:           str, path of the dataset in the zarr hierarchy
+          events:         array-like of float, event times
+          window:         tuple (start, stop) of float, window relative to each event time, e.g. (-0.5, 1.)
+          timestamps:     str, path of the timestamps dataset of the samples. default is 'timestamps' next to
+                          the dataset if it exists, otherwise 'starting_time' and its 'rate' attribute are used
+          rate:           float, sampling rate, default rate from 'starting_time', or estimated from timestamps
+          starting_time:  float, time of the first sample when there are no timestamps, default from 'starting_time'
+          fill_value:     value of samples of windows outside the dataset, default nan for floating point datasets
+                          and 0 otherwise
+          block_bytes:    int, maximum size in bytes of a block of adjacent chunks read at once. default 64 MiB
+        Returns:
+          numpy.ndarray of shape (events, window samples) + dataset shape[1:]
+        """
+        zarray = self._get_zarray(path)
+        if zarray.ndim == 0:
+            raise ValueError(f"{path}: cannot read windows of a scalar dataset")
+        if not isinstance(block_bytes, int):
+            raise TypeError(f"Expected int for block_bytes, recieved {type(block_bytes)}")
+        events = np.atleast_1d(np.asarray(events, dtype='float64'))
+        w_start, w_stop = window
+
+        # samples of the window starts
+        parent = str(PurePosixPath(zarray.path).parent)
+        group = self.zgroup if parent == '.' else self.zgroup[parent]
+        if timestamps is None and 'timestamps' in group:
+            timestamps = _path_to_prefix('' if parent == '.' else parent) + 'timestamps'
+        if timestamps is not None:
+            ts = self._get_zarray(timestamps)[:]
+            if rate is None:
+                rate = (len(ts) - 1)/(ts[-1] - ts[0]) if len(ts) > 1 else 1.
+            starts = np.searchsorted(ts, events + w_start, side='left').astype('int64')
+        else:
+            if rate is None or starting_time is None:
+                if 'starting_time' not in group:
+                    raise ValueError(f"{path}: timestamps or rate and starting_time are required")
+                if rate is None:
+                    rate = float(group['starting_time'].attrs['rate'])
+                if starting_time is None:
+                    starting_time = float(group['starting_time'][()])
+            starts = np.ceil((events + w_start - starting_time)*rate - 1e-9).astype('int64')
+        n_samples = int(round((w_stop - w_start)*rate))
+
+        if fill_value is None:
+            fill_value = np.nan if zarray.dtype.kind in 'fc' else 0
+        out = np.full((len(events), n_samples) + zarray.shape[1:], fill_value, dtype=zarray.dtype)
+        lo = np.clip(starts, 0, zarray.shape[0])
+        hi = np.clip(starts + n_samples, 0, zarray.shape[0])
+        valid = np.nonzero(hi > lo)[0]
+        if not len(valid):
+            return out
+
+        # chunks along the first axis covering the windows, grouped in blocks of adjacent chunks
+        chunk_len = zarray.chunks[0]
+        needed = np.unique(np.concatenate([np.arange(lo[i]//chunk_len, (hi[i] - 1)//chunk_len + 1)
+                                           for i in valid]))
+        row_bytes = chunk_len*int(np.prod(zarray.shape[1:]))*zarray.dtype.itemsize
+        block_len = max(1, block_bytes//max(row_bytes, 1))
+        blocks = []
+        for chunk in needed:
+            if blocks and chunk == blocks[-1][1] and chunk - blocks[-1][0] < block_len:
+                blocks[-1][1] = chunk + 1
+            else:
+                blocks.append([chunk, chunk + 1])
+
+        # file order
+        locations = self._chunk_locations(zarray)
+        if locations:
+            chunk_offsets = dict()
+            for chunk_index, loc in locations.items():
+                chunk_offsets[chunk_index[0]] = min(chunk_offsets.get(chunk_index[0], loc['offset']), loc['offset'])
+            blocks.sort(key=lambda block: chunk_offsets.get(block[0], -1))
+
+        for first, last in blocks:
+            start = first*chunk_len
+            stop = min(last*chunk_len, zarray.shape[0])
+            data = zarray[start:stop]
+            for i in valid[(lo[valid] < stop) & (hi[valid] > start)]:
+                a = max(lo[i], start)
+                b = min(hi[i], stop)
+                out[i, a-starts[i]:b-starts[i]] = data[a-start:b-start]
+        return out
+
+    def read_ragged(self, path: str, rows=None, index_path: str = None):
+        """ Read rows of a ragged dataset, e.g. spike times of units from 'units/spike_times'.
+        The index dataset is read once, and the data of all requested rows is read into one buffer
+        with one read for each run of rows separated by less than a chunk.
+        Args:
+          path:           str, path of the data dataset in the zarr hierarchy
+          rows:           int, slice or sequence of int, rows to read. default all rows
+          index_path:     str, path of the index dataset holding the end of each row in the data dataset,
+                          default path + '_index'
+        Returns:
+          numpy.ndarray for an int row, otherwise list of numpy.ndarray, views into one buffer
+        """
+        zarray = self._get_zarray(path)
+        if zarray.ndim == 0:
+            raise ValueError(f"{path}: cannot read rows of a scalar dataset")
+        index = self._get_zarray(index_path or path + '_index')[:].astype('int64')
+        starts = np.concatenate(([0], index))[:-1]
+
+        if rows is None:
+            rows = np.arange(len(index))
+        elif isinstance(rows, slice):
+            rows = np.arange(len(index))[rows]
+        elif not isinstance(rows, (int, np.integer)):
+            rows = np.asarray(rows, dtype='int64')
+        selection = np.atleast_1d(np.arange(len(index))[rows])
+        row_start = starts[selection]
+        row_stop = index[selection]
+
+        buffer, shift = self._read_ranges(zarray, row_start, row_stop)
+        ret = [buffer[start-d:stop-d] for start, stop, d in zip(row_start, row_stop, shift)]
+        return ret[0] if isinstance(rows, (int, np.integer)) else ret
+
+    @staticmethod
+    def _read_ranges(zarray, row_start, row_stop):
+        """ Read ranges of a dataset along the first axis into one buffer,
+        with one read for each run of ranges separated by less than a chunk
+        Args:
+          zarray:         zarr.Array
+          row_start:      numpy.ndarray of int, start of each range
+          row_stop:       numpy.ndarray of int, end of each range
+        Returns:
+          tuple (numpy.ndarray, numpy.ndarray), buffer and offset of each range, range i is
+          buffer[row_start[i]-offset[i]:row_stop[i]-offset[i]]
+        """
+        # runs of ranges without a whole chunk between them, in data order
+        chunk_len = zarray.chunks[0]
+        order = np.argsort(row_start, kind='stable')
+        runs = []
+        for i in order:
+            if row_start[i] == row_stop[i]:
+                continue
+            if runs and row_start[i]//chunk_len <= (runs[-1][1] - 1)//chunk_len + 1:
+                runs[-1][1] = max(runs[-1][1], row_stop[i])
+            else:
+                runs.append([row_start[i], row_stop[i]])
+
+        buffer = np.empty((sum(stop - start for start, stop in runs),) + zarray.shape[1:], dtype=zarray.dtype)
+        run_offsets = []
+        pos = 0
+        for start, stop in runs:
+            zarray.get_basic_selection(slice(start, stop), out=buffer[pos:pos+stop-start])
+            run_offsets.append(start - pos)
+            pos += stop - start
+
+        # buffer position of each range, from the run holding it. empty ranges map to the buffer start
+        run_starts = np.array([start for start, _ in runs], dtype='int64')
+        run_index = np.searchsorted(run_starts, row_start, side='right') - 1
+        shift = np.where(row_start == row_stop, row_start, np.asarray(run_offsets + [0], dtype='int64')[run_index])
+        return buffer, shift
+
+    def read_table(self, path: str, columns=None, rows=None, format: str = 'pandas', read_workers: int = 8):
+        """ Read columns of a table group, e.g. 'units', 'intervals/trials' or the electrodes table, directly from the
+        zarr hierarchy. Columns are read in parallel, ranges of selected rows with one read for each run of rows
+        separated by less than a chunk, and ragged columns are split with their index datasets.
+        Object references are returned as paths of the referenced objects, and compound columns as records.
+        Args:
+          path:           str, path of the table group in the zarr hierarchy
+          columns:        sequence of str, column names, default 'colnames' attribute of the group
+          rows:           int, slice or sequence of int, rows to read. default all rows
+          format:         str, 'pandas', pandas.DataFrame indexed by the id dataset, ragged cells are numpy arrays
+                          'arrow', pyarrow.Table with an 'id' column, ragged columns are list arrays.
+                          tables without id dataset are indexed by row numbers
+          read_workers:   int, number of threads reading columns, default 8
+        Returns:
+          pandas.DataFrame or pyarrow.Table
+        """
+        if format not in ('pandas', 'arrow'):
+            raise ValueError("format must be 'pandas' or 'arrow'")
+        if not isinstance(read_workers, int):
+            raise TypeError(f"Expected int for read_workers, recieved {type(read_workers)}")
+        try:
+            if format == 'pandas':
+                import pandas as pd
+            else:
+                import pyarrow as pa
+        except ImportError:
+            raise ImportError(f"read_table with format '{format}' requires {format}, "
+                              f"install it with 'pip install {format}'")
+
+        group = self.zgroup[path]
+        if not isinstance(group, zarr.Group):
+            raise TypeError(f"{path} is not a group")
+        if columns is None:
+            # colnames of tables written with optional columns left out may list missing columns
+            columns = [name for name in group.attrs.get('colnames', []) if name in group]
+        else:
+            columns = list(columns)
+            for name in columns:
+                if name not in group:
+                    raise KeyError(f"{path} has no column {name}")
+
+        # without an id dataset, rows are identified by their row numbers
+        names = (['id'] if 'id' in group else []) + columns
+        indexes = {name: self._column_indexes(group, name) for name in names}
+        if names:
+            n_rows = group[(indexes[names[0]] or names)[0]].shape[0]
+        else:
+            raise ValueError(f"{path} has no id dataset and no columns")
+        selection = np.atleast_1d(np.arange(n_rows)[slice(None) if rows is None else rows]).astype('int64')
+
+        def read_column(name):
+            values, offsets = self._read_table_column(group, name, indexes[name], selection)
+            refs = group[name].attrs.get(REFERENCES, {}).get('data')
+            if refs:
+                values = self._resolve_references(values, refs)
+            return values, offsets
+
+        if read_workers > 1:
+            with ThreadPoolExecutor(max_workers=read_workers, thread_name_prefix='HDF5Zarr-read_table') as executor:
+                results = dict(zip(names, executor.map(read_column, names)))
+        else:
+            results = {name: read_column(name) for name in names}
+        ids = results.pop('id')[0] if 'id' in group else selection
+
+        if format == 'pandas':
+            data = OrderedDict()
+            for name in columns:
+                values, offsets = results[name]
+                if values.dtype.names is not None:
+                    values = np.fromiter(values.tolist(), dtype=object, count=len(values)) if len(values) else \
+                        np.empty(0, dtype=object)
+                for offsets_level in offsets[::-1]:
+                    cells = np.empty(len(offsets_level) - 1, dtype=object)
+                    cells[:] = np.split(values, offsets_level[1:-1]) if len(cells) else []
+                    values = cells
+                if values.ndim > 1:
+                    cells = np.empty(len(values), dtype=object)
+                    cells[:] = list(values)
+                    values = cells
+                data[name] = values
+            return pd.DataFrame(data, index=pd.Index(ids, name='id'))
+
+        arrays = [pa.array(ids)]
+        for name in columns:
+            values, offsets = results[name]
+            array = _arrow_array(pa, values)
+            for offsets_level in offsets[::-1]:
+                array = pa.LargeListArray.from_arrays(pa.array(offsets_level, type=pa.int64()), array)
+            arrays.append(array)
+        return pa.Table.from_arrays(arrays, names=['id'] + columns)
+
+    @staticmethod
+    def _column_indexes(group, name):
+        # index datasets of a column of a table group, outermost index first
+        levels = []
+        while f"{name}{'_index'*(len(levels)+1)}" in group:
+            levels.insert(0, f"{name}{'_index'*(len(levels)+1)}")
+        return levels
+
+    def _read_table_column(self, group, name, indexes, selection):
+        """ Read the selected rows of a column of a table group
+        Args:
+          group:          zarr.Group, table group
+          name:           str, column name
+          indexes:        list of str, names of the index datasets of the column, outermost first
+          selection:      numpy.ndarray of int, rows
+        Returns:
+          tuple (numpy.ndarray, list of numpy.ndarray), values of the rows, and for each index level the offsets
+          of the rows of the level in the rows of the next level, or in the values
+        """
+        def positions(start, stop):
+            # position of each element of the ranges, and the range holding it
+            lengths = stop - start
+            first = np.cumsum(lengths) - lengths
+            return np.arange(int(lengths.sum())) + np.repeat(start - first, lengths), \
+                np.repeat(np.arange(len(start)), lengths)
+
+        # ranges of the selected rows in the outermost dataset, and at each index level the ranges of
+        # the rows in the next dataset
+        row_start, row_stop = selection, selection + 1
+        offsets = []
+        for index_path in indexes:
+            # read the entry before each range too, it holds the start of the first row
+            entries, shift = self._read_ranges(group[index_path], np.maximum(row_start - 1, 0), row_stop)
+            pos, range_index = positions(row_start, row_stop)
+            buffer_pos = pos - shift[range_index]
+            row_stop = entries[buffer_pos].astype('int64')
+            row_start = np.where(pos > 0, entries[np.maximum(buffer_pos - 1, 0)], 0).astype('int64')
+            offsets.append(np.concatenate(([0], np.cumsum(row_stop - row_start))))
+
+        data, shift = self._read_ranges(group[name], row_start, row_stop)
+        pos, range_index = positions(row_start, row_stop)
+        return data[pos - shift[range_index]], offsets
+
+    def _resolve_references(self, values, fields):
+        """ Replace object references stored as addresses by the paths of the referenced objects
+        Args:
+          values:         numpy.ndarray, addresses, or records with address fields
+          fields:         True, or list of str, names of the address fields
+        Returns:
+          numpy.ndarray of paths, None for null references, or records with object fields for the paths
+        """
+        if self._address_index is None:
+            try:
+                self._address_index = _AddressIndex(
+                    self.zgroup.store[_path_to_prefix(self.zgroup.path) + address_meta_key])
+            except KeyError:
+                print("hierarchy has no address index, references are returned as addresses")
+                return values
+
+        if fields is True:
+            return self._address_index.resolve(values)
+        ret = np.empty(values.shape, dtype=[(name, object if name in fields else values.dtype[name])
+                                            for name in values.dtype.names])
+        for name in values.dtype.names:
+            ret[name] = self._address_index.resolve(values[name]) if name in fields else values[name]
+        return ret
+
+    def materialize(self, paths, chunks=None, compressor=None, processes: int = None, block_bytes: int = 64*2**20):
+        """ Copy datasets into the store as native zarr chunks, rechunked and recompressed, e.g. datasets that are
+        read often and are uncompressed or badly chunked in the hdf5 file. Datasets are read in blocks of whole
+        chunks, and blocks are read and compressed in a pool of processes. The arrays are then read from the store,
+        their chunk location metadata and chunk statistics are removed, other arrays keep reading the hdf5 file.
+        Consolidated metadata, written by consolidate_metadata or found at '.zmetadata', is written again.
+        Args:
+          paths:          str or sequence of str, paths of datasets in the zarr hierarchy
+          chunks:         tuple of int, or dict mapping paths to tuple of int, new chunk shape.
+                          default None, chunk shape guessed by zarr
+          compressor:     numcodecs.abc.Codec, compressor of the new chunks, default Blosc zstd
+          processes:      int, number of processes reading and compressing blocks, 0 or 1 reads them
+                          in this process, required if the hdf5 file was passed as a file-like object without
+                          name. default None, number of cpus
+          block_bytes:    int, target size of a block in bytes, rounded down to whole chunks along the first axis,
+                          a block is at least one chunk wide. default 64 MiB
+        Returns:
+          dict mapping paths to stored bytes
+        """
+        if self.store_mode == 'r':
+            raise ReadOnlyError()
+        if not isinstance(block_bytes, int):
+            raise TypeError(f"Expected int for block_bytes, recieved {type(block_bytes)}")
+        if processes is None:
+            processes = os.cpu_count() or 1
+        if not isinstance(processes, int):
+            raise TypeError(f"Expected int for processes, recieved {type(processes)}")
+        if compressor is None:
+            compressor = numcodecs.Blosc(cname='zstd', clevel=5, shuffle=numcodecs.Blosc.SHUFFLE)
+        paths = [paths] if isinstance(paths, str) else list(paths)
+
+        # the store itself, zgroup may be a read-only consolidated view, or a decoded view hiding compressors
+        store = self.store
+        ret = dict()
+        for path in paths:
+            zarray = self._get_zarray(path)
+            if zarray.dtype.hasobject:
+                raise TypeError(f"{path}: cannot materialize dataset of object dtype")
+            if zarray.ndim == 0:
+                raise ValueError(f"{path}: cannot materialize a scalar dataset")
+            prefix = _path_to_prefix(zarray.path)
+            if prefix + chunks_meta_key not in store:
+                raise ValueError(f"{path} has no chunk location metadata, it is not read from the hdf5 file")
+            zarray_meta = store[prefix + array_meta_key]
+            zarray_meta = json_loads(zarray_meta) if isinstance(zarray_meta, bytes) else dict(zarray_meta)
+
+            new_chunks = chunks.get(path) if isinstance(chunks, dict) else chunks
+            new_chunks = zarr.util.normalize_chunks(True if new_chunks is None else new_chunks,
+                                                    zarray.shape, zarray.dtype.itemsize)
+            zarray_meta.update(chunks=list(new_chunks), compressor=compressor.get_config(), filters=None)
+
+            # blocks of whole chunks of the new array, and of the hdf5 dataset if both fit in a block
+            row_bytes = int(np.prod(zarray.shape[1:]))*zarray.dtype.itemsize
+            unit = int(np.lcm(new_chunks[0], zarray.chunks[0]))
+            if unit*row_bytes > block_bytes:
+                unit = new_chunks[0]
+            block_len = unit*max(1, block_bytes//max(unit*row_bytes, 1))
+            blocks = [(start, min(start + block_len, zarray.shape[0])) for start in range(0, zarray.shape[0], block_len)]
+            # source array without chunk cache, the chunk store reopens the file in pool processes
+            chunk_store = self.chunk_store
+            if isinstance(chunk_store, zarr.LRUStoreCache):
+                chunk_store = chunk_store._store
+            source = zarr.Array(zarray.store, path=zarray.path, read_only=True, chunk_store=chunk_store)
+            if processes > 1:
+                if chunk_store._uri is None:
+                    raise TypeError(f'{chunk_store._source}: cannot read blocks in processes, '
+                                    'hdf5 file has no uri')
+                # pool processes open the array over a copy of its own documents, not the whole store
+                docs = {prefix + key: self.store[prefix + key] for key in zarr.storage.listdir(self.store, zarray.path)}
+                source = (docs, zarray.path, chunk_store._uri, chunk_store._fs)
+
+            with _transaction(store):
+                stale = {key for key in zarr.storage.listdir(store, zarray.path) if not key.startswith('.')}
+                stored = 0
+                for chunk_items in _map_blocks(_materialize_block, blocks, source, zarray_meta, processes):
+                    for key, value in chunk_items:
+                        store[prefix + key] = value
+                        stored += len(value)
+                        stale.discard(key)
+                for key in stale:
+                    del store[prefix + key]
+                store[prefix + array_meta_key] = json_dumps(zarray_meta)
+                for name in (chunks_meta_key, chunkstats_meta_key):
+                    if prefix + name in store:
+                        del store[prefix + name]
+            self._invalidate_chunk_store(zarray.path)
+            ret[path] = stored
+
+        consolidated = self._consolidated
+        if consolidated is None and '.zmetadata' in store:
+            meta = store['.zmetadata']
+            meta = json_loads(meta) if isinstance(meta, bytes) else meta
+            consolidated = {'metadata_key': '.zmetadata', 'sharded': 'shards' in meta}
+        if consolidated is not None:
+            self.consolidate_metadata(**consolidated)
+        return ret
+
+    def extract(self, start, stop, store, compressor=None, block_bytes: int = 64*2**20):
+        """ Copy a time window of the hierarchy into a new zarr hierarchy with native chunks, e.g. an epoch of
+        a session to share. Time series, groups with a data dataset and a timestamps or a starting_time dataset,
+        keep their samples in the window, interval tables their rows overlapping the window, and units their spikes
+        in the window. Interval indexes are built for the rows kept. Other datasets, attributes and the address index
+        are copied, datasets of object dtype other than strings are not. Datasets are copied in blocks of whole
+        chunks, sliced datasets only within the window, so that extraction time scales with the window, spike times
+        are read whole.
+        Args:
+          start:          number, start of the time window
+          stop:           number, end of the time window, excluded
+          store:          collections.abc.MutableMapping or str, zarr store of the new hierarchy, its contents
+                          are removed. if string path is passed, zarr.DirectoryStore is created at the given path
+          compressor:     numcodecs.abc.Codec, compressor of the new arrays, default Blosc zstd
+          block_bytes:    int, target size of a block in bytes, rounded down to whole chunks along the first axis,
+                          a block is at least one chunk wide. default 64 MiB
+        Returns:
+          zarr.Group, root group of the new hierarchy
+        """
+        if not isinstance(block_bytes, int):
+            raise TypeError(f"Expected int for block_bytes, recieved {type(block_bytes)}")
+        if compressor is None:
+            compressor = numcodecs.Blosc(cname='zstd', clevel=5, shuffle=numcodecs.Blosc.SHUFFLE)
+        dest = zarr.open_group(store, mode='w')
+
+        # groups of the hierarchy, paths relative to the root group
+        groups = []
+
+        def walk(path, group):
+            groups.append((path, group))
+            for name, subgroup in group.groups():
+                walk(_path_to_prefix(path) + name, subgroup)
+        walk('', self.zgroup)
+
+        # samples of time series in the window, known before interval tables referencing them are sliced
+        windows = dict()
+        for path, group in groups:
+            names = set(group.array_keys())
+            if 'data' not in names or group['data'].ndim == 0:
+                continue
+            if 'timestamps' in names and group['timestamps'].ndim == 1:
+                sel = self.time_range(_path_to_prefix(path) + 'timestamps', start, stop)
+                windows[path] = (sel.start, sel.stop)
+            elif 'starting_time' in names and group['starting_time'].attrs.get('rate'):
+                rate = group['starting_time'].attrs['rate']
+                t0 = float(group['starting_time'][()])
+                n = group['data'].shape[0]
+                first = int(np.clip(np.ceil((start - t0)*rate), 0, n))
+                windows[path] = (first, int(np.clip(np.ceil((stop - t0)*rate), first, n)))
+
+        for path, group in groups:
+            zgroup = dest.require_group(path) if path else dest
+            zgroup.attrs.put(group.attrs.asdict())
+            names = list(group.array_keys())
+            # new contents of datasets, and windows of datasets copied in blocks
+            arrays = dict()
+            sliced = dict()
+
+            if path in windows:
+                first, last = windows[path]
+                for name in ('data', 'timestamps', 'control'):
+                    if name in names and group[name].ndim and group[name].shape[0] == group['data'].shape[0]:
+                        sliced[name] = windows[path]
+                if 'timestamps' not in names:
+                    starting_time = group['starting_time']
+                    arrays['starting_time'] = np.asarray(starting_time[()] + first/starting_time.attrs['rate'],
+                                                         dtype=starting_time.dtype)
+
+            if 'start_time' in names and 'stop_time' in names and 'colnames' in group.attrs:
+                rows = self.find_intervals(path, start, stop)
+                for name in ['id'] + list(group.attrs['colnames']):
+                    if name not in names:
+                        continue
+                    levels = self._column_indexes(group, name)
+                    values, offsets = self._read_table_column(group, name, levels, rows)
+                    arrays[name] = self._extract_sample_refs(group[name], values, windows)
+                    for level, level_offsets in zip(levels, offsets):
+                        arrays[level] = level_offsets[1:].astype(group[level].dtype)
+                if self._interval_index(group) is not None and {'start_time', 'stop_time'} <= set(arrays):
+                    _write_interval_index(zgroup, arrays['start_time'], arrays['stop_time'])
+
+            if 'spike_times' in names and 'spike_times_index' in names:
+                spike_times = group['spike_times'][:]
+                keep = (spike_times >= start) & (spike_times < stop)
+                kept = np.concatenate(([0], np.cumsum(keep)))
+                arrays['spike_times'] = spike_times[keep]
+                index = group['spike_times_index']
+                arrays['spike_times_index'] = kept[index[:].astype('int64')].astype(index.dtype)
+
+            for name in names:
+                self._extract_array(group[name], zgroup, name, arrays.get(name), sliced.get(name), compressor,
+                                    block_bytes)
+
+        try:
+            index = self.zgroup.store[_path_to_prefix(self.zgroup.path) + address_meta_key]
+        except KeyError:
+            pass
+        else:
+            dest.store[_path_to_prefix(dest.path) + address_meta_key] = \
+                index if isinstance(index, bytes) else json_dumps(index)
+        return dest
+
+    def _extract_sample_refs(self, zarray, values, windows):
+        """ Shift idx_start and count of references to time series samples, e.g. timeseries column of trials,
+        to the samples of the time series kept by extract
+        """
+        refs = zarray.attrs.get(REFERENCES, {}).get('data')
+        if values.dtype.names is None or not refs or not {'idx_start', 'count'} <= set(values.dtype.names):
+            return values
+        paths = self._resolve_references(values, refs)[refs[0]]
+        values = values.copy()
+        for i, path in enumerate(paths):
+            window = windows.get(path.lstrip('/')) if path else None
+            if window is None or values['idx_start'][i] < 0:
+                continue
+            first, last = window
+            new_start = np.clip(values['idx_start'][i] - first, 0, last - first)
+            new_stop = np.clip(values['idx_start'][i] + values['count'][i] - first, new_start, last - first)
+            values['idx_start'][i] = new_start
+            values['count'][i] = new_stop - new_start
+        return values
+
+    @staticmethod
+    def _extract_array(zarray, zgroup, name, data, window, compressor, block_bytes):
+        """ Write data, or the window of zarray along the first axis, default all, to a new array of zgroup.
+        The new array is removed if writing it fails
+        """
+        object_codec = None
+        if zarray.dtype.hasobject:
+            # variable-length strings, other object data, e.g. compound datasets with strings, are not extracted
+            if zarray.dtype != object or not any(isinstance(f, (numcodecs.VLenUTF8, VLenHDF5String))
+                                                 for f in zarray.filters or ()):
+                print(f"Dataset {zarray.path} is not extracted: object dtype, not strings")
+                return
+            object_codec = numcodecs.VLenUTF8()
+        # zarr does not normalize fill values of structured dtypes
+        fill_value = None if zarray.dtype.names else zarray.fill_value
+        try:
+            if data is not None or zarray.ndim == 0:
+                data = zarray[...] if data is None else data
+                new = zgroup.array(name, data, chunks=zarray.chunks if data.ndim else True, compressor=compressor,
+                                   fill_value=fill_value, object_codec=object_codec)
+            else:
+                first, last = window or (0, zarray.shape[0])
+                new = zgroup.create(name, shape=(last - first,) + zarray.shape[1:], chunks=zarray.chunks,
+                                    dtype=zarray.dtype, compressor=compressor, fill_value=fill_value,
+                                    object_codec=object_codec)
+                # blocks of whole chunks of the new array
+                chunk_len = zarray.chunks[0]
+                row_bytes = chunk_len*int(np.prod(zarray.shape[1:]))*zarray.dtype.itemsize
+                block_len = chunk_len*max(1, block_bytes//max(row_bytes, 1))
+                for pos in range(0, last - first, block_len):
+                    new[pos:pos+block_len] = zarray[first+pos:min(first+pos+block_len, last)]
+            new.attrs.put(zarray.attrs.asdict())
+        except BaseException:
+            if name in zgroup:
+                del zgroup[name]
+            raise
+
+    def _invalidate_chunk_store(self, path):
+        chunk_store = self.chunk_store
+        if isinstance(chunk_store, zarr.LRUStoreCache):
+            chunk_store.invalidate_values()
+            chunk_store = chunk_store._store
+        chunk_store.invalidate(path)
+
     def _fill_regfilters(self):
 
-        # h5py.h5z.FILTER_DEFLATE == 1
-        self._hdf5_regfilters_subset[1] = numcodecs.GZip
+        # h5py.h5z.FILTER_DEFLATE == 1, zlib stream without gzip header
+        self._hdf5_regfilters_subset[1] = numcodecs.Zlib
 
         # h5py.h5z.FILTER_SHUFFLE == 2
         self._hdf5_regfilters_subset[2] = None
@@ -301,12 +1316,32 @@ class HDF5Zarr(object):
         self._hdf5_regfilters_subset[32018] = None
 
     def copy_attrs_data_to_zarr_store(self, h5obj, zobj):
-        """ Convert hdf5 attributes to json compatible form and create zarr attributes
+        """ Convert hdf5 attributes to json compatible form and create zarr attributes.
+        Object references are recorded in the REFERENCES attribute, a dict with
+            'attributes':   names of attributes holding the path of a referenced object
+            'data':         for datasets of object references, target path of a scalar dataset,
+                            True for an array of object addresses, or names of reference fields of a compound dtype
+        The root of the hierarchy always has the REFERENCES attribute, readers rely on it instead of guessing references.
         Args:
             h5obj:   hdf5 object
             zobj:    zarr object
         """
 
+        references = dict()
+        if isinstance(h5obj, h5py.Dataset):
+            if h5obj.dtype.names is not None:
+                ref_fields = [name for name in h5obj.dtype.names
+                              if h5py.check_ref_dtype(h5obj.dtype[name]) is h5py.Reference]
+                if ref_fields:
+                    references['data'] = ref_fields
+            elif h5py.check_ref_dtype(h5obj.dtype) is h5py.Reference:
+                if h5obj.shape == ():
+                    ref = h5obj[()]
+                    if ref and self.file[ref].name:
+                        references['data'] = self.file[ref].name
+                else:
+                    references['data'] = True
+
         for key, val in h5obj.attrs.items():
 
             # convert object references in attrs to str
@@ -317,6 +1352,7 @@ class HDF5Zarr(object):
                     deref_obj = self.file[val]
                     if deref_obj.name:
                         val = self.file[val].name
+                        references.setdefault('attributes', []).append(key)
                     else:
                         print(f"Attribute value of type {type(val)} is not processed: \
                                 Attribute {key} of object {h5obj.name}, anonymous target")
@@ -339,6 +1375,9 @@ class HDF5Zarr(object):
             except Exception:
                 print(f"Attribute value of type {type(val)} is not processed: Attribute {key} of object {h5obj.name}")
 
+        if references or zobj.path == self.zgroup.path:
+            zobj.attrs[REFERENCES] = references
+
     def storage_info(self, dset, dset_chunks):
         if dset.shape is None:
             # Null dataset
@@ -549,6 +1588,11 @@ class HDF5Zarr(object):
 
                 object_codec = None
 
+                # small datasets are copied to the store, uncompressed in one chunk
+                inline = self._inline_dataset(dset)
+                if inline:
+                    compression = None
+
                 if dset.dtype.names is not None:
                     # Structured array with Reference dtype
 
@@ -570,12 +1614,13 @@ class HDF5Zarr(object):
                                 dset_fillvalue[dt_i] = 0
                         else:
                             dtype_ += [(dtname, dset.dtype.base[dt_i])]
-                    zarray = zgroup.create_dataset(dset.name, shape=dset.shape,
-                                                   dtype=dtype_,
-                                                   chunks=dset.chunks or False,
-                                                   fill_value=tuple(dset_fillvalue),
-                                                   compression=compression,
-                                                   overwrite=True)
+                    zarray = self.zgroup.create_dataset(dset.name.lstrip('/'), shape=dset.shape,
+                                                        dtype=dtype_,
+                                                        chunks=False if inline else dset.chunks or False,
+                                                        fill_value=tuple(dset_fillvalue),
+                                                        compression=compression,
+                                                        overwrite=True)
+                    dset_chunks = dset.chunks
 
                 # variable-length Datasets
                 elif h5py.check_vlen_dtype(dset.dtype):
@@ -583,14 +1628,18 @@ class HDF5Zarr(object):
                         print(f"Dataset {dset.name} is not processed: Variable-length dataset, not string")
                         continue
                     else:
-                        object_codec = VLenHDF5String()
-                        zarray = zgroup.create_dataset(dset.name, shape=dset.shape,
-                                                       dtype=object,
-                                                       chunks=dset.chunks or False,
-                                                       fill_value=dset.fillvalue,
-                                                       compression=compression,
-                                                       overwrite=True,
-                                                       object_codec=object_codec)
+                        object_codec = numcodecs.VLenUTF8() if inline else VLenHDF5String()
+                        # h5py 3 returns the fill value of variable-length strings as bytes
+                        dset_fillvalue = dset.fillvalue
+                        if isinstance(dset_fillvalue, bytes):
+                            dset_fillvalue = dset_fillvalue.decode('utf-8')
+                        zarray = self.zgroup.create_dataset(dset.name.lstrip('/'), shape=dset.shape,
+                                                            dtype=object,
+                                                            chunks=False if inline else dset.chunks or False,
+                                                            fill_value=dset_fillvalue,
+                                                            compression=compression,
+                                                            overwrite=True,
+                                                            object_codec=object_codec)
                         dset_chunks = dset.chunks
 
                 elif dset.dtype.hasobject:
@@ -606,12 +1655,13 @@ class HDF5Zarr(object):
                         else:
                             dset_fillvalue = 0
 
-                        zarray = zgroup.create_dataset(dset.name, shape=dset.shape,
-                                                       dtype=dtype_,
-                                                       chunks=dset.chunks or False,
-                                                       fill_value=dset_fillvalue,
-                                                       compression=compression,
-                                                       overwrite=True)
+                        zarray = self.zgroup.create_dataset(dset.name.lstrip('/'), shape=dset.shape,
+                                                            dtype=dtype_,
+                                                            chunks=dset.chunks or False,
+                                                            fill_value=dset_fillvalue,
+                                                            compression=compression,
+                                                            overwrite=True)
+                        dset_chunks = dset.chunks
 
                     elif dset_type.get_class() == h5py.h5t.STD_REF_DSETREG:
                         print(f"Dataset {dset.name} is not processed: Region Reference dtype")
@@ -641,14 +1691,18 @@ class HDF5Zarr(object):
                     else:
                         dset_chunks = dset.chunks
 
-                    zarray = zgroup.create_dataset(dset.name, shape=dset.shape,
-                                                   dtype=dset.dtype,
-                                                   chunks=dset_chunks or False,
-                                                   fill_value=dset.fillvalue,
-                                                   compression=compression,
-                                                   overwrite=True)
+                    zarray = self.zgroup.create_dataset(dset.name.lstrip('/'), shape=dset.shape,
+                                                        dtype=dset.dtype,
+                                                        chunks=False if inline else dset_chunks or False,
+                                                        fill_value=dset.fillvalue,
+                                                        compression=compression,
+                                                        overwrite=True)
 
                 self.copy_attrs_data_to_zarr_store(dset, zarray)
+                self._address_dict[h5py.h5o.get_info(dset.id).addr] = dset.name
+                if inline:
+                    zarray[...] = dset.asstr()[()] if object_codec is not None else dset[()]
+                    continue
                 info = self.storage_info(dset, dset_chunks)
 
                 if object_codec is not None:
@@ -659,6 +1713,8 @@ class HDF5Zarr(object):
                     info['source'] = {'uri': self.uri,
                                       'array_name': dset.name}
                     FileChunkStore.chunks_info(zarray, info)
+                    if self.chunk_stats:
+                        self._store_chunk_stats(dset, zarray)
 
             # Groups
             elif (issubclass(h5py_group.get(name, getclass=True), h5py.Group) and
@@ -667,19 +1723,66 @@ class HDF5Zarr(object):
                     print(f"Group {obj.name} is not processed: External Link")
                     continue
                 group_ = obj
-                zgroup_ = self.zgroup.create_group(group_.name, overwrite=True)
+                zgroup_ = self.zgroup.create_group(group_.name.lstrip('/'), overwrite=True)
                 self.create_zarr_hierarchy(group_, zgroup_)
 
             # Groups, Soft Link
             elif (issubclass(h5py_group.get(name, getclass=True), h5py.Group) and
                   issubclass(obj_linkclass, h5py.SoftLink)):
                 group_ = obj
-                zgroup_ = self.zgroup.create_group(group_.name, overwrite=True)
+                zgroup_ = self.zgroup.create_group(group_.name.lstrip('/'), overwrite=True)
                 self.copy_attrs_data_to_zarr_store(group_, zgroup_)
 
                 zgroup_path = zgroup_.create_group(SYMLINK, overwrite=True)
                 zgroup_path.attrs[group_.name] = h5py_group.get(name, getlink=True).path
 
+        if self.interval_index:
+            self._store_interval_index(h5py_group, zgroup)
+
+    def _store_interval_index(self, h5py_group, zgroup):
+        """ Store the interval index of a group with start_time and stop_time datasets """
+        columns = [h5py_group.get(name) for name in ('start_time', 'stop_time')]
+        if not all(isinstance(col, h5py.Dataset) and col.ndim == 1 and col.dtype.kind in 'iuf' for col in columns):
+            return
+        start, stop = (col[:] for col in columns)
+        if len(start) != len(stop):
+            return
+        _write_interval_index(zgroup, start, stop)
+
+    def _inline_dataset(self, dset):
+        """ Whether dset is copied to the store. Datasets with object references and compound datasets with
+        variable-length members are not copied
+        """
+        if not 0 < dset.id.get_storage_size() <= self.inline_threshold:
+            return False
+        if dset.dtype.names is not None or not h5py.check_vlen_dtype(dset.dtype):
+            return not dset.dtype.hasobject
+        return h5py.check_string_dtype(dset.dtype) is not None
+
+    def _store_chunk_stats(self, dset, zarray):
+        """ Store minimum, maximum and number of elements of each chunk of a sorted one-dimensional numeric dataset """
+        if zarray.ndim != 1 or dset.dtype.kind not in 'iuf' or zarray.shape[0] == 0:
+            return
+        chunk_len = zarray.chunks[0]
+        stats = {'min': [], 'max': [], 'count': []}
+        for start in range(0, zarray.shape[0], chunk_len):
+            data = dset[start:start+chunk_len]
+            # non-decreasing, nan compares false
+            if not np.all(data[1:] >= data[:-1]) or (stats['max'] and not data[0] >= stats['max'][-1]):
+                return
+            stats['min'].append(data[0].item())
+            stats['max'].append(data[-1].item())
+            stats['count'].append(len(data))
+        zarray.store[_path_to_prefix(zarray.path) + chunkstats_meta_key] = json_dumps(stats)
+
+    def _store_address_index(self):
+        """ Store addresses of hdf5 objects in file and their paths as sorted arrays, for resolving
+        object references stored as addresses
+        """
+        addresses = sorted(self._address_dict)
+        index = {'addresses': addresses, 'paths': [self._address_dict[addr] for addr in addresses]}
+        self.zgroup.store[_path_to_prefix(self.zgroup.path) + address_meta_key] = json_dumps(index)
+
     @staticmethod
     def _rewrite_vlen_to_fixed(h5py_group, changed_dsets={}):
         """  Scan hdf5 file or hdf5 group object and recursively convert variable-length string dataset to fixed-length
@@ -763,6 +1866,50 @@ class HDF5Zarr(object):
 # from zarr.storage: #
 chunks_meta_key = '.zchunkstore'
 
+# hdf5 object address index at the root of a hierarchy
+address_meta_key = '.zaddress'
+
+# chunk statistics of sorted datasets, see HDF5Zarr.time_range
+chunkstats_meta_key = '.zchunkstats'
+
+# interval index of groups with start_time and stop_time datasets, see HDF5Zarr.find_intervals
+intervals_meta_key = '.zintervals'
+
+# metadata documents of a hierarchy, consolidated by HDF5Zarr.consolidate_metadata
+_metadata_names = ('.zgroup', '.zarray', '.zattrs', chunks_meta_key, address_meta_key, chunkstats_meta_key)
+
+
+class _AddressIndex(object):
+    """ Paths of hdf5 objects by address, parsed from the address index of a hierarchy """
+
+    def __init__(self, index):
+        if not isinstance(index, dict):
+            index = json_loads(index)
+        self.addresses = np.asarray(index['addresses'], dtype='uint64')
+        # missing addresses map to the trailing None
+        self.paths = np.asarray(index['paths'] + [None], dtype=object)
+
+    def resolve(self, addresses):
+        """ Paths of hdf5 object addresses, None for null references and addresses not in the index """
+        addresses = np.asarray(addresses, dtype='uint64')
+        pos = np.searchsorted(self.addresses, addresses)
+        found = pos < len(self.addresses)
+        found[found] = self.addresses[pos[found]] == addresses[found]
+        pos[~found] = len(self.addresses)
+        return self.paths[pos]
+
+
+def _write_interval_index(zgroup, start, stop):
+    """ Store intervals ordered by start time, with the running maximum of stop times, for overlap queries
+    with two binary searches
+    """
+    order = np.argsort(start, kind='stable')
+    index = {'order': order.tolist(),
+             'start': start[order].tolist(),
+             'stop': stop[order].tolist(),
+             'max_stop': np.maximum.accumulate(stop[order]).tolist()}
+    zgroup.store[_path_to_prefix(zgroup.path) + intervals_meta_key] = json_dumps(index)
+
 
 def _path_to_prefix(path):
     # assume path already normalized
@@ -773,42 +1920,590 @@ def _path_to_prefix(path):
     return prefix
 
 
-class FileChunkStore(MutableMapping):
+def _arrow_array(pa, values):
+    # records as struct arrays, trailing dimensions as fixed size lists
+    if values.dtype.names is not None:
+        return pa.StructArray.from_arrays([_arrow_array(pa, values[name]) for name in values.dtype.names],
+                                          names=list(values.dtype.names))
+    if values.ndim > 1:
+        return pa.FixedSizeListArray.from_arrays(_arrow_array(pa, values.reshape((-1,) + values.shape[2:])),
+                                                 values.shape[1])
+    return pa.array(values)
+
+
+# source array of _materialize_block in pool processes
+_materialize_source = None
+
+
+def _materialize_init(zarray):
+    global _materialize_source
+    if isinstance(zarray, tuple):
+        # documents of the array, its path, and uri and filesystem of the hdf5 file
+        docs, path, uri, fs = zarray
+        zarray = zarr.Array(docs, path=path, read_only=True, chunk_store=FileChunkStore(docs, uri=uri, fs=fs))
+    _materialize_source = zarray
+
+
+def _materialize_block(block, zarray_meta):
+    # encoded chunks of the new array for a block of rows, written through a temporary zarr array
+    start, stop = block
+    target = zarr.create(store=dict(), shape=zarray_meta['shape'], chunks=zarray_meta['chunks'],
+                         dtype=_materialize_source.dtype, compressor=numcodecs.get_codec(zarray_meta['compressor']),
+                         fill_value=_materialize_source.fill_value, order=zarray_meta['order'],
+                         dimension_separator=zarray_meta.get('dimension_separator'), write_empty_chunks=False)
+    target[start:stop] = _materialize_source[start:stop]
+    return [(key, ensure_bytes(value)) for key, value in target.store.items() if not key.startswith('.')]
+
+
+def _map_blocks(func, blocks, zarray, zarray_meta, processes):
+    # results of func for blocks in order, with at most two blocks per process in flight
+    if processes <= 1:
+        _materialize_init(zarray)
+        for block in blocks:
+            yield func(block, zarray_meta)
+        return
+    with ProcessPoolExecutor(max_workers=processes, initializer=_materialize_init,
+                             initargs=(zarray,)) as executor:
+        pending = []
+        for block in blocks:
+            pending.append(executor.submit(func, block, zarray_meta))
+            if len(pending) >= 2*processes:
+                yield pending.pop(0).result()
+        for future in pending:
+            yield future.result()
+
+
+def _chunk_store_decodes(zarray_meta):
+    # arrays decompressed by FileChunkStore in decode mode
+    return zarray_meta.get('compressor') is not None and not zarray_meta.get('filters')
+
+
+class DecodedMetadataStore(_BaseStore):
+    """View of a metadata store for FileChunkStore decode mode.
+    Compressed arrays with file chunk location metadata are presented to zarr
+    without compressor, their chunks are decompressed by FileChunkStore.
+    Parameters
+    ----------
+    store : MutableMapping
+        Store for zarr metadata and file chunk location metadata.
+    """
+
+    def __init__(self, store):
+        self._store = store
+
+    @property
+    def store(self):
+        """The underlying metadata store"""
+        return self._store
+
+    def __getitem__(self, key):
+        value = self._store[key]
+        if key.endswith(array_meta_key) and key[:-len(array_meta_key)] + chunks_meta_key in self._store:
+            zarray_meta = json_loads(value) if isinstance(value, bytes) else value
+            if _chunk_store_decodes(zarray_meta):
+                zarray_meta = dict(zarray_meta, compressor=None)
+                value = json_dumps(zarray_meta) if isinstance(value, bytes) else zarray_meta
+        return value
+
+    def __setitem__(self, key, value):
+        self._store[key] = value
+
+    def __delitem__(self, key):
+        del self._store[key]
+
+    def __contains__(self, key):
+        return key in self._store
+
+    def __iter__(self):
+        return iter(self._store)
+
+    def __len__(self):
+        return len(self._store)
+
+    def listdir(self, path=None):
+        return zarr.storage.listdir(self._store, path)
+
+
+class SQLiteMetadataStore(zarr.SQLiteStore):
+    """Single-file store for zarr metadata and file chunk location metadata.
+    A zarr.SQLiteStore with transactions, so that a hierarchy is written in one
+    batch and is not left partially written if creating it fails, and with bulk
+    reads of metadata documents.
+    Parameters
+    ----------
+    path : str
+        Location of the database file.
+    **kwargs
+        Passed to zarr.SQLiteStore.
+    """
+
+    def __init__(self, path, **kwargs):
+        super().__init__(path, **kwargs)
+        # autocommit, transactions are begun and ended by transaction only
+        self.db.isolation_level = None
+        self._transaction_depth = 0
+
+    @contextmanager
+    def transaction(self):
+        """Write all changes made in the context at once, or none of them if an exception is raised.
+        Nested transactions are part of the outermost one.
+        """
+        with self.lock:
+            if self._transaction_depth == 0:
+                self.cursor.execute('BEGIN')
+            self._transaction_depth += 1
+        try:
+            yield self
+        except BaseException:
+            with self.lock:
+                self._transaction_depth -= 1
+                if self._transaction_depth == 0:
+                    self.cursor.execute('ROLLBACK')
+            raise
+        else:
+            with self.lock:
+                self._transaction_depth -= 1
+                if self._transaction_depth == 0:
+                    self.cursor.execute('COMMIT')
+
+    def update(self, *args, **kwargs):
+        # one statement, part of the open transaction if any
+        items = [(key, ensure_contiguous_ndarray(value)) for dct in args + (kwargs,) for key, value in dct.items()]
+        with self.lock:
+            self.cursor.executemany('REPLACE INTO zarr VALUES (?, ?)', items)
+
+    def clear(self):
+        # zarr.SQLiteStore drops the table in a script, which commits the open transaction
+        with self.lock:
+            self.cursor.execute('DELETE FROM zarr')
+
+    def __getitem__(self, key):
+        # one shared cursor, serialize reads of chunk store threads
+        with self.lock:
+            return super().__getitem__(key)
+
+    def __contains__(self, key):
+        with self.lock:
+            return super().__contains__(key)
+
+    def getitems(self, keys, **kwargs):
+        """Values of several keys, read with one query per 500 keys."""
+        keys = list(keys)
+        ret = dict()
+        with self.lock:
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i+500]
+                rows = self.cursor.execute(f'SELECT k, v FROM zarr WHERE k IN ({",".join("?"*len(batch))})', batch)
+                ret.update(rows.fetchall())
+        return ret
+
+    def metadata_items(self, names=_metadata_names):
+        """All metadata documents, read with one query.
+        Parameters
+        ----------
+        names : tuple of str
+            Names of the metadata documents.
+        Returns
+        -------
+        list of (key, value) tuples
+        """
+        condition = ' OR '.join(['k = ? OR k LIKE ?']*len(names))
+        parameters = [p for name in names for p in (name, '%/' + name)]
+        with self.lock:
+            return self.cursor.execute(f'SELECT k, v FROM zarr WHERE {condition}', parameters).fetchall()
+
+    # results are fetched at once, reading values while iterating keys reuses the cursor
+
+    def items(self):
+        with self.lock:
+            return iter(self.cursor.execute('SELECT k, v FROM zarr').fetchall())
+
+    def keys(self):
+        with self.lock:
+            return iter([k for k, in self.cursor.execute('SELECT k FROM zarr').fetchall()])
+
+    def values(self):
+        with self.lock:
+            return iter([v for v, in self.cursor.execute('SELECT v FROM zarr').fetchall()])
+
+    def __iter__(self):
+        return self.keys()
+
+    def __len__(self):
+        with self.lock:
+            return super().__len__()
+
+
+class ShardedConsolidatedMetadataStore(_BaseStore):
+    """Read-only store of consolidated metadata written by
+    HDF5Zarr.consolidate_metadata with ``sharded=True``.
+    The root document holds the metadata outside of top-level groups and lists
+    the shards. The shard of a top-level group is read and parsed on first
+    access to one of its keys.
+    Parameters
+    ----------
+    store : MutableMapping
+        Store holding the consolidated metadata documents.
+    metadata_key : str
+        Key of the root consolidated metadata document.
+    """
+
+    def __init__(self, store, metadata_key='.zmetadata'):
+        self.store = store
+        self.metadata_key = metadata_key
+        meta = json_loads(store[metadata_key])
+        if meta.get('zarr_consolidated_format') != 1:
+            raise ValueError(f"unsupported zarr consolidated metadata format: {meta.get('zarr_consolidated_format')}")
+        self.meta_store = meta['metadata']
+        self._shards = {path: None for path in meta.get('shards', [])}
+        self._lock = threading.Lock()
+
+    def _shard_path(self, key):
+        # top-level group shard holding key, None for keys in the root document
+        i = key.find('/')
+        while i != -1:
+            if key[:i] in self._shards:
+                return key[:i]
+            i = key.find('/', i + 1)
+        return None
+
+    def _shard(self, path):
+        if path is None:
+            return self.meta_store
+        with self._lock:
+            if self._shards[path] is None:
+                self._shards[path] = json_loads(self.store[path + '/' + self.metadata_key])['metadata']
+            return self._shards[path]
+
+    def __getitem__(self, key):
+        return self._shard(self._shard_path(key))[key]
+
+    def __contains__(self, key):
+        return key in self._shard(self._shard_path(key))
+
+    def __iter__(self):
+        yield from self.meta_store
+        for path in self._shards:
+            yield from self._shard(path)
+
+    def __len__(self):
+        return len(self.meta_store) + sum(len(self._shard(path)) for path in self._shards)
+
+    def listdir(self, path=None):
+        prefix = _path_to_prefix(zarr.storage.normalize_storage_path(path))
+        shard_path = self._shard_path(prefix)
+        names = {key[len(prefix):].split('/')[0] for key in self._shard(shard_path) if key.startswith(prefix)}
+        if shard_path is None:
+            names.update(p[len(prefix):].split('/')[0] for p in self._shards if p.startswith(prefix))
+        return sorted(names)
+
+    def __setitem__(self, key, value):
+        raise ReadOnlyError()
+
+    def __delitem__(self, key):
+        raise ReadOnlyError()
+
+
+def _transaction(store):
+    # batched writes for stores supporting transactions
+    if isinstance(store, zarr.LRUStoreCache):
+        store = store._store
+    if isinstance(store, SQLiteMetadataStore):
+        return store.transaction()
+    return nullcontext()
+
+
+# stores pickled as their location, unpickling reopens the location
+_location_stores = (zarr.DirectoryStore, zarr.SQLiteStore, zarr.ZipStore, zarr.DBMStore, zarr.LMDBStore,
+                    zarr.storage.FSStore)
+
+
+def _store_reference(store):
+    """ Store pickled in place of a chunk store index store or of the HDF5Zarr store: the store holding the
+    documents, without cache and view layers. Only stores pickled as their location are accepted, in-memory
+    stores would be copied whole into each pickle.
+    """
+    while True:
+        if isinstance(store, zarr.LRUStoreCache):
+            store = store._store
+        elif isinstance(store, (DecodedMetadataStore, zarr.storage.ConsolidatedMetadataStore,
+                                ShardedConsolidatedMetadataStore)):
+            store = store.store
+        else:
+            break
+    if not isinstance(store, _location_stores):
+        raise TypeError(f'{type(store).__name__}: cannot pickle a reference to an in-memory store, '
+                        'use a store with a location such as SQLiteMetadataStore or zarr.DirectoryStore')
+    return store
+
+
+def _read_at(source, offset, size, lock):
+    """ Read size bytes at offset of a chunk source without moving its file position, so that threads read in
+    parallel: local files with os.pread, fsspec files of other file systems with a range request. Other file objects
+    are read with seek and read, holding lock.
+    """
+    try:
+        fd = source.fileno() if hasattr(os, 'pread') else None
+    except (AttributeError, OSError, ValueError):
+        # io.UnsupportedOperation is an OSError and a ValueError
+        fd = None
+    if fd is not None:
+        chunks = []
+        while size > 0:
+            data = os.pread(fd, size, offset)
+            if not data:
+                break
+            chunks.append(data)
+            offset += len(data)
+            size -= len(data)
+        return chunks[0] if len(chunks) == 1 else b''.join(chunks)
+    fs = getattr(source, 'fs', None)
+    path = getattr(source, 'path', None)
+    if isinstance(fs, fsspec.AbstractFileSystem) and isinstance(path, str):
+        return fs.cat_file(path, start=offset, end=offset + size)
+    with lock:
+        source.seek(offset, os.SEEK_SET)
+        return source.read(size)
+
+
+class _SharedChunkIndex(object):
+    """ Parsed chunk location metadata of a metadata store, shared within a process.
+    Unpickled FileChunkStore instances with the same token share one store object and one parsed index.
+    Each process reopens the store once per token and parses the documents it reads.
+    """
+
+    _registry = weakref.WeakValueDictionary()
+    _registry_lock = threading.Lock()
+
+    def __init__(self, store, token):
+        self.store = store
+        self.token = token
+        self.zchunks = {}
+        self.chunk_order = {}
+
+    @classmethod
+    def register(cls, store, token=None):
+        with cls._registry_lock:
+            if token is None:
+                token = uuid.uuid4().hex
+            index = cls._registry.get(token)
+            if index is None:
+                index = cls(store, token)
+                cls._registry[token] = index
+            return index
+
+
+class FileChunkStore(_BaseStore):
     """A file as a chunk store.
     Zarr array chunks are all in a single file.
     Parameters
     ----------
     store : MutableMapping
-        Store for file chunk location metadata.
+        Store for file chunk location metadata. Chunks without location
+        metadata are read from this store, if present. Pickling the chunk
+        store requires a store pickled as its location, e.g.
+        SQLiteMetadataStore or zarr.DirectoryStore.
     chunk_source : file-like object
         Source (file) containing chunk bytes. Must be seekable and readable.
+        If None, the file at `uri` is opened on first read.
+    prefetch : int
+        Number of chunks to read ahead on a background thread once sequential
+        access to an array is detected. Sequential means consecutive chunks in
+        the order of their file offsets in ``.zchunkstore``. Default 0, disabled.
+    decode_workers : int
+        Decode mode. If 0 (default), chunks are returned as stored and zarr
+        decompresses them. Otherwise chunks of compressed arrays are decompressed
+        by the chunk store, using `decode_workers` threads when several chunks
+        are read at once. The arrays must then be opened through a
+        `DecodedMetadataStore`, which hides their compressor from zarr.
+    uri : str
+        Location of the chunk source, by default taken from `chunk_source`.
+        Required to pickle the chunk store.
+    fs : fsspec.AbstractFileSystem
+        File system to open `uri` with, by default taken from `chunk_source`,
+        or inferred from `uri` by fsspec.
     """
 
-    def __init__(self, store, chunk_source):
-        self._store = store
-        if not (chunk_source.seekable and chunk_source.readable):
+    # number of consecutive sequential reads before read-ahead starts
+    _sequential_threshold = 2
+
+    # chunks separated by at most _coalesce_gap bytes are read at once, up to _coalesce_max bytes per read
+    _coalesce_gap = 2**12
+    _coalesce_max = 2**26
+
+    def __init__(self, store, chunk_source=None, prefetch=0, decode_workers=0, uri=None, fs=None):
+        if chunk_source is not None and not (chunk_source.seekable and chunk_source.readable):
             raise TypeError(f'{chunk_source}: chunk source is not '
                             'seekable and readable')
         self._source = chunk_source
+        # sources opened by the chunk store are closed by close, sources passed in belong to the caller
+        self._owns_source = False
+        # uri and fsspec filesystem to reopen the chunk source, e.g. after unpickling
+        if uri is None and chunk_source is not None:
+            uri = getattr(chunk_source, 'path', None) or getattr(chunk_source, 'name', None)
+            if fs is None:
+                fs = getattr(chunk_source, 'fs', None)
+        if chunk_source is None and uri is None:
+            raise ValueError('Either chunk_source or uri must be given')
+        self._uri = uri if isinstance(uri, str) else None
+        self._fs = fs
+        self._init_options(store, prefetch, decode_workers)
+
+    def _init_options(self, store, prefetch, decode_workers, token=None):
         self._gcol = {}
         # TO DO #
         self.dt_vlen = np.dtype([('size', 'uint32'), ('address', 'uint64'), ('id', 'uint32')])
 
+        if not isinstance(prefetch, int) or prefetch < 0:
+            raise ValueError(f"Expected non-negative int for prefetch, recieved {prefetch}")
+        self._prefetch = prefetch
+
+        if not isinstance(decode_workers, int) or decode_workers < 0:
+            raise ValueError(f"Expected non-negative int for decode_workers, recieved {decode_workers}")
+        self._decode_workers = decode_workers
+
+        # parsed .zchunkstore documents and chunk order by file offset,
+        # shared by all copies of this chunk store in a process
+        self._index = _SharedChunkIndex.register(store, token)
+        self._store = self._index.store
+        self._init_state()
+
+    def _init_state(self):
+        # opening and closing the source, and seek and read on sources without positional reads
+        self._lock = threading.Lock()
+        # read-ahead bookkeeping and executors, shared by threads reading the store
+        self._prefetch_lock = threading.Lock()
+
+        # per array (last position in chunk order, length of sequential run)
+        self._access = {}
+        # chunk key -> Future, holds at most `prefetch` chunks
+        self._prefetched = OrderedDict()
+        self._prefetch_executor = None
+        self._prefetch_stats = {'hits': 0, 'misses': 0, 'issued': 0, 'discarded': 0}
+
+        self._decode_executor = None
+        # chunk size and codec, per array
+        self._array_info = {}
+
+    def __getstate__(self):
+        """Pickle as chunk source uri, index store reference and options, the source is reopened on first read."""
+        if self._uri is None:
+            raise TypeError(f'{self._source}: cannot pickle FileChunkStore, chunk source has no uri')
+        return {'store': _store_reference(self._index.store), 'token': self._index.token, 'uri': self._uri,
+                'fs': self._fs, 'prefetch': self._prefetch, 'decode_workers': self._decode_workers}
+
+    def __setstate__(self, state):
+        self._source = None
+        self._owns_source = False
+        self._uri = state['uri']
+        self._fs = state['fs']
+        self._init_options(state['store'], state['prefetch'], state['decode_workers'], token=state['token'])
+
+    @property
+    def _zchunks(self):
+        return self._index.zchunks
+
+    @property
+    def _chunk_order(self):
+        return self._index.chunk_order
+
     @property
     def store(self):
-        """MutableMapping store for file chunk information"""
+        """MutableMapping store for file chunk location metadata"""
         return self._store
 
     @store.setter
     def store(self, new_store):
         """Set the new store for file chunk location metadata."""
         self._store = new_store
+        self._index = _SharedChunkIndex.register(new_store)
+        self._array_info = {}
+
+    def invalidate(self, path):
+        """Drop cached chunk location metadata and chunk information of an array, after its metadata changed."""
+        prefix = _path_to_prefix(path)
+        zchunk_key = str(PurePosixPath(prefix + chunks_meta_key))
+        self._zchunks.pop(zchunk_key, None)
+        self._chunk_order.pop(zchunk_key, None)
+        self._array_info.pop(prefix + array_meta_key, None)
+        with self._prefetch_lock:
+            self._access.pop(zchunk_key, None)
+            for chunk_key in [k for k in self._prefetched if k.startswith(prefix)]:
+                self._prefetched.pop(chunk_key).cancel()
 
     @property
     def source(self):
         """The file object where chunks are stored."""
+        if self._source is None:
+            with self._lock:
+                self._open_source()
         return self._source
 
+    @property
+    def uri(self):
+        """The uri of the file where chunks are stored."""
+        return self._uri
+
+    def _open_source(self):
+        if self._source is None:
+            if self._fs is not None:
+                self._source = self._fs.open(self._uri, mode='rb')
+            else:
+                self._source = fsspec.open(self._uri, mode='rb').open()
+            self._owns_source = True
+
+    def _shutdown_executors(self, wait=True):
+        with self._prefetch_lock:
+            for future in self._prefetched.values():
+                future.cancel()
+            self._prefetched.clear()
+            executors = (self._prefetch_executor, self._decode_executor)
+            self._prefetch_executor = self._decode_executor = None
+        for executor in executors:
+            if executor is not None:
+                executor.shutdown(wait=wait)
+
+    def close(self):
+        """Stop read-ahead and decode threads and close the source file. The file is reopened on the next read."""
+        self._shutdown_executors()
+        with self._lock:
+            if self._source is not None and self._owns_source:
+                self._source.close()
+                self._source = None
+
+    def __del__(self):
+        try:
+            self._shutdown_executors(wait=False)
+        except AttributeError:
+            # partially initialized
+            pass
+
+    @property
+    def prefetch(self):
+        """Number of chunks read ahead for sequential access."""
+        return self._prefetch
+
+    @property
+    def decode_workers(self):
+        """Number of threads decoding chunks, 0 if zarr decodes chunks."""
+        return self._decode_workers
+
+    @property
+    def prefetch_info(self):
+        """Read-ahead metrics.
+        Returns
+        -------
+        dict
+            ``depth``: read-ahead depth, ``buffered``: chunks currently held,
+            ``hits``: reads served from the read-ahead buffer, ``misses``: reads
+            from the file, ``issued``: chunks scheduled for read-ahead,
+            ``discarded``: read-ahead chunks dropped unused.
+        """
+        with self._prefetch_lock:
+            info = {'depth': self._prefetch, 'buffered': len(self._prefetched)}
+            info.update(self._prefetch_stats)
+        return info
+
     @staticmethod
     def chunks_info(zarray, chunks_loc):
         """Store chunks location information for a Zarr array.
@@ -847,6 +2542,31 @@ class FileChunkStore(MutableMapping):
         else:
             return obj
 
+    def _get_zchunks(self, zchunk_key):
+        """Parsed chunk location metadata of an array, cached per array."""
+        zchunks = self._zchunks.get(zchunk_key)
+        if zchunks is None:
+            zchunks = self._ensure_dict(self._store[zchunk_key])
+            self._zchunks[zchunk_key] = zchunks
+        return zchunks
+
+    def _get_chunk_order(self, zchunk_key):
+        """Chunk keys of an array sorted by file offset, and the position of each key."""
+        order = self._chunk_order.get(zchunk_key)
+        if order is None:
+            zchunks = self._get_zchunks(zchunk_key)
+            keys = sorted((k for k in zchunks if k != 'source'), key=lambda k: zchunks[k]['offset'])
+            order = (keys, {k: i for i, k in enumerate(keys)})
+            self._chunk_order[zchunk_key] = order
+        return order
+
+    def _source_key(self, zchunk_key):
+        """Identifier of the file holding the chunks of an array, chunks of one file may be read together."""
+        return None
+
+    def _read(self, offset, size, zchunk_key):
+        return _read_at(self.source, offset, size, self._lock)
+
     def __getitem__(self, chunk_key):
         """Read in chunk bytes.
         Parameters
@@ -860,15 +2580,79 @@ class FileChunkStore(MutableMapping):
         """
         zchunk_key = self._get_chunkstore_key(chunk_key)
         try:
-            zchunks = self._ensure_dict(self._store[zchunk_key])
-            chunk_loc = zchunks[chunk_key]
+            zchunks = self._get_zchunks(zchunk_key)
         except KeyError:
-            raise KeyError(chunk_key)
+            zchunks = dict()
+        if chunk_key not in zchunks:
+            return self._load_stored_chunk(chunk_key, zchunk_key)
+
+        if not self._prefetch:
+            return self._load_chunk(chunk_key, zchunk_key)
+
+        future = self._take_prefetched(chunk_key, zchunk_key)
+        if future is not None:
+            try:
+                bytes = future.result()
+            except Exception:
+                # cancelled or failed read-ahead, read again below
+                pass
+            else:
+                self._count_prefetch('hits')
+                return bytes
+        self._count_prefetch('misses')
+        return self._load_chunk(chunk_key, zchunk_key)
+
+    def _take_prefetched(self, chunk_key, zchunk_key):
+        """Remove and return the read-ahead future of a chunk, if any, and schedule the next read-ahead."""
+        keys, position = self._get_chunk_order(zchunk_key)
+        with self._prefetch_lock:
+            future = self._prefetched.pop(chunk_key, None)
+            self._schedule_prefetch(chunk_key, zchunk_key, keys, position)
+        return future
+
+    def _count_prefetch(self, name):
+        with self._prefetch_lock:
+            self._prefetch_stats[name] += 1
+
+    def _schedule_prefetch(self, chunk_key, zchunk_key, keys, position):
+        """Track access order of an array and read ahead once access is sequential.
+        Called with _prefetch_lock held."""
+        pos = position[chunk_key]
+        last_pos, run = self._access.get(zchunk_key, (None, 0))
+        if last_pos is not None and pos == last_pos + 1:
+            run += 1
+        elif pos != last_pos:
+            run = 1
+        self._access[zchunk_key] = (pos, run)
+        if run < self._sequential_threshold:
+            return
+
+        if self._prefetch_executor is None:
+            self._prefetch_executor = ThreadPoolExecutor(max_workers=1,
+                                                         thread_name_prefix='FileChunkStore-prefetch')
+        for next_key in keys[pos+1:pos+1+self._prefetch]:
+            if next_key in self._prefetched:
+                continue
+            # bounded buffer, drop the oldest read-ahead chunk
+            while len(self._prefetched) >= self._prefetch:
+                _, stale = self._prefetched.popitem(last=False)
+                stale.cancel()
+                self._prefetch_stats['discarded'] += 1
+            self._prefetched[next_key] = self._prefetch_executor.submit(self._load_chunk, next_key, zchunk_key)
+            self._prefetch_stats['issued'] += 1
+
+    def _load_chunk(self, chunk_key, zchunk_key):
+        """Read chunk bytes from the source file and prepare them for zarr."""
+        chunk_loc = self._get_zchunks(zchunk_key)[chunk_key]
 
         # Read chunk's data...
+        bytes = self._read(chunk_loc['offset'], chunk_loc['size'], zchunk_key)
+
+        return self._prepare_chunk(chunk_key, zchunk_key, bytes)
 
-        self._source.seek(chunk_loc['offset'], os.SEEK_SET)
-        bytes = self._source.read(chunk_loc['size'])
+    def _prepare_chunk(self, chunk_key, zchunk_key, bytes):
+        """Resolve variable-length strings, decode in decode mode, and pad chunk bytes."""
+        chunk_loc = self._get_zchunks(zchunk_key)[chunk_key]
 
         # variable-length string
         if 'gcol_offsets' in chunk_loc:
@@ -881,40 +2665,151 @@ class FileChunkStore(MutableMapping):
             data_bytes = np.empty(shape=len(data_offsets)+1, dtype=object)
             data_bytes[0] = bytes
 
+            source_key = self._source_key(zchunk_key)
             for i in range(len(data_offsets)):
                 offset_item = data_offsets[i]
-                if offset_item not in self._gcol:
+                gcol_key = (source_key, offset_item)
+                if gcol_key not in self._gcol:
                     gcol_size, skip = chunk_loc['gcol_offsets'][str(offset_item)]
                     gcol_size = gcol_size - skip
                     offset = offset_item + skip
-                    self._source.seek(offset, os.SEEK_SET)
-                    gcol_bytes = self._source.read(gcol_size)
-                    self._gcol[offset] = gcol_bytes
+                    gcol_bytes = self._read(offset, gcol_size, zchunk_key)
+                    self._gcol[gcol_key] = gcol_bytes
                     data_bytes[i+1] = gcol_bytes
                 else:
-                    data_bytes[i+1] = self._gcol[offset]
+                    data_bytes[i+1] = self._gcol[gcol_key]
 
             return data_bytes
 
+        return self._decode_chunk(chunk_key, bytes)
+
+    def _load_stored_chunk(self, chunk_key, zchunk_key):
+        """Chunk bytes kept in the metadata store, e.g. inline chunks of imported references."""
+        try:
+            bytes = ensure_bytes(self._store[chunk_key])
+        except KeyError:
+            raise KeyError(chunk_key)
+        if zchunk_key in self._zchunks or zchunk_key in self._store:
+            # chunks of arrays with file chunk location metadata are decoded and padded as file chunks
+            bytes = self._decode_chunk(chunk_key, bytes)
+        return bytes
+
+    def _decode_chunk(self, chunk_key, bytes):
+        """Decode chunk bytes in decode mode, and pad them up to chunk size."""
         try:
             # Get array chunk size
-            zarray_key = self._get_array_key(chunk_key)
-            zarray_key = self._ensure_dict(self._store[zarray_key])
-            dtype_str = zarray_key['dtype']
+            zarray_chunksize, codec = self._get_array_info(self._get_array_key(chunk_key))
+        except KeyError:
+            raise KeyError(chunk_key)
+
+        if codec is not None:
+            bytes = ensure_bytes(codec.decode(bytes))
+
+        # Pad up to chunk size
+        if len(bytes) < zarray_chunksize:
+            bytes = bytes.ljust(zarray_chunksize, b'\0')
+
+        return bytes
+
+    def _get_array_info(self, zarray_key):
+        """Chunk size in bytes and, in decode mode, the codec of an array."""
+        info = self._array_info.get(zarray_key)
+        if info is None:
+            zarray_meta = self._ensure_dict(self._store[zarray_key])
+            dtype_str = zarray_meta['dtype']
             # compound dtype
             if isinstance(dtype_str, list):
                 dtype_str = [tuple(el) for el in dtype_str]
 
             zarray_itemsize = np.dtype(dtype_str).itemsize
-            zarray_chunksize = np.prod(zarray_key['chunks'])*zarray_itemsize
-            # Pad up to chunk size
-            if len(bytes) < zarray_chunksize:
-                bytes = bytes.ljust(zarray_chunksize, b'\0')
+            zarray_chunksize = int(np.prod(zarray_meta['chunks']))*zarray_itemsize
+            codec = None
+            if self._decode_workers and _chunk_store_decodes(zarray_meta):
+                codec = numcodecs.get_codec(zarray_meta['compressor'])
+            info = (zarray_chunksize, codec)
+            self._array_info[zarray_key] = info
+        return info
+
+    def getitems(self, keys, **kwargs):
+        """Read in bytes of several chunks.
+        Chunks are read in file offset order, and chunks close to each other in the
+        file are read at once. In decode mode, chunks are decompressed on a pool of
+        `decode_workers` threads.
+        Parameters
+        ----------
+        keys : iterable of str
+            Zarr array chunk keys.
+        Returns
+        -------
+        dict
+            Bytes of the requested chunks that are in the store, by chunk key.
+        """
+        ret = dict()
+        located = []
+        for chunk_key in keys:
+            zchunk_key = self._get_chunkstore_key(chunk_key)
+            try:
+                chunk_loc = self._get_zchunks(zchunk_key)[chunk_key]
+            except KeyError:
+                try:
+                    ret[chunk_key] = self._load_stored_chunk(chunk_key, zchunk_key)
+                except KeyError:
+                    pass
+                continue
+            located.append((chunk_loc['offset'], chunk_loc['size'], chunk_key, zchunk_key))
+        # file offset order within each file
+        source_keys = {item[3]: str(self._source_key(item[3])) for item in located}
+        located.sort(key=lambda item: (source_keys[item[3]], item[0]))
+
+        if self._prefetch:
+            pending = []
+            for item in located:
+                future = self._take_prefetched(item[2], item[3])
+                if future is not None and not future.cancelled() and future.exception() is None:
+                    ret[item[2]] = future.result()
+                    self._count_prefetch('hits')
+                else:
+                    pending.append(item)
+                    self._count_prefetch('misses')
+            located = pending
+
+        # combine reads of nearby chunks
+        raw = []
+        i = 0
+        while i < len(located):
+            start = located[i][0]
+            stop = start + located[i][1]
+            j = i + 1
+            while (j < len(located) and source_keys[located[j][3]] == source_keys[located[i][3]] and
+                   located[j][0] - stop <= self._coalesce_gap and
+                   located[j][0] + located[j][1] - start <= self._coalesce_max):
+                stop = max(stop, located[j][0] + located[j][1])
+                j += 1
+            buf = self._read(start, stop - start, located[i][3])
+            for offset, size, chunk_key, zchunk_key in located[i:j]:
+                raw.append((chunk_key, zchunk_key, buf[offset-start:offset-start+size]))
+            i = j
+
+        if self._decode_workers > 1 and len(raw) > 1:
+            with self._prefetch_lock:
+                if self._decode_executor is None:
+                    self._decode_executor = ThreadPoolExecutor(max_workers=self._decode_workers,
+                                                               thread_name_prefix='FileChunkStore-decode')
+            chunks = self._decode_executor.map(lambda item: self._prepare_chunk(*item), raw)
+        else:
+            chunks = (self._prepare_chunk(*item) for item in raw)
+        for item, chunk in zip(raw, chunks):
+            ret[item[0]] = chunk
 
-        except KeyError:
-            raise KeyError(chunk_key)
+        return ret
 
-        return bytes
+    def __contains__(self, chunk_key):
+        try:
+            if chunk_key in self._get_zchunks(self._get_chunkstore_key(chunk_key)):
+                return True
+        except KeyError:
+            pass
+        return chunk_key in self._store
 
     def _get_array_key(self, chunk_key):
         return str(PurePosixPath(chunk_key).parent / array_meta_key)
@@ -955,6 +2850,168 @@ class FileChunkStore(MutableMapping):
         raise RuntimeError(f'{chunk_key}: Cannot modify chunk data')
 
 
+class _PooledFile(object):
+    """ File open in a MultiFileChunkStore, with the number of reads using it and a lock for sources read with
+    seek and read """
+
+    def __init__(self, source):
+        self.source = source
+        self.lock = threading.Lock()
+        self.readers = 0
+        self.evicted = False
+
+
+class MultiFileChunkStore(FileChunkStore):
+    """Several files as a chunk store.
+    Zarr array chunks are read from the file recorded as ``source.uri`` in
+    the ``.zchunkstore`` of each array, so one zarr hierarchy can hold the
+    arrays of many files, e.g. one HDF5Zarr hierarchy per store_path.
+    Parameters
+    ----------
+    store : MutableMapping
+        Store for file chunk location metadata.
+    max_open_files : int
+        Maximum number of files kept open, the least recently used file is
+        closed when another file needs to be opened, once no read uses it.
+        Default 128.
+    fs : fsspec.AbstractFileSystem
+        File system to open the recorded uris with, by default inferred from
+        each uri by fsspec.
+    uri_map : dict
+        Optional mapping of recorded uris to the locations to open, for files
+        that moved after the hierarchy was created.
+    prefetch : int
+        See `FileChunkStore`.
+    decode_workers : int
+        See `FileChunkStore`.
+    """
+
+    def __init__(self, store, max_open_files=128, fs=None, uri_map=None, prefetch=0, decode_workers=0):
+        if not isinstance(max_open_files, int) or max_open_files < 1:
+            raise ValueError(f"Expected positive int for max_open_files, recieved {max_open_files}")
+        self._max_open_files = max_open_files
+        self._uri_map = dict(uri_map or {})
+        self._source = None
+        self._uri = None
+        self._fs = fs
+        self._init_options(store, prefetch, decode_workers)
+
+    def _init_state(self):
+        super()._init_state()
+        # uri -> open file, least recently used first
+        self._sources = OrderedDict()
+        self._open_stats = {'opened': 0, 'closed': 0}
+
+    def __getstate__(self):
+        """Pickle as index store reference and options, files are reopened on first read."""
+        return {'store': _store_reference(self._index.store), 'token': self._index.token, 'fs': self._fs,
+                'max_open_files': self._max_open_files, 'uri_map': self._uri_map,
+                'prefetch': self._prefetch, 'decode_workers': self._decode_workers}
+
+    def __setstate__(self, state):
+        self._max_open_files = state['max_open_files']
+        self._uri_map = state['uri_map']
+        self._source = None
+        self._uri = None
+        self._fs = state['fs']
+        self._init_options(state['store'], state['prefetch'], state['decode_workers'], token=state['token'])
+
+    @property
+    def source(self):
+        """Open files by uri."""
+        with self._lock:
+            return {uri: pooled.source for uri, pooled in self._sources.items()}
+
+    @property
+    def max_open_files(self):
+        """Maximum number of files kept open."""
+        return self._max_open_files
+
+    @property
+    def open_files_info(self):
+        """Number of files currently open, and files opened and closed so far."""
+        info = {'open': len(self._sources)}
+        info.update(self._open_stats)
+        return info
+
+    def _source_key(self, zchunk_key):
+        try:
+            return self._get_zchunks(zchunk_key)['source']['uri']
+        except KeyError:
+            raise KeyError(f'{zchunk_key}: chunk source information missing')
+
+    def _read(self, offset, size, zchunk_key):
+        pooled = self._acquire(self._source_key(zchunk_key))
+        try:
+            return _read_at(pooled.source, offset, size, pooled.lock)
+        finally:
+            self._release(pooled)
+
+    def _acquire(self, uri):
+        """Pooled file of uri, marked in use. self._lock is held for the pool bookkeeping only, files are opened
+        and read without it, so a slow file does not block reads of other files."""
+        with self._lock:
+            pooled = self._sources.get(uri)
+            if pooled is not None:
+                self._sources.move_to_end(uri)
+                pooled.readers += 1
+                return pooled
+        location = self._uri_map.get(uri, uri)
+        if self._fs is not None:
+            source = self._fs.open(location, mode='rb')
+        else:
+            source = fsspec.open(location, mode='rb').open()
+        stale = []
+        with self._lock:
+            pooled = self._sources.get(uri)
+            if pooled is None:
+                pooled = _PooledFile(source)
+                source = None
+                self._sources[uri] = pooled
+                self._open_stats['opened'] += 1
+                while len(self._sources) > self._max_open_files:
+                    _, evicted = self._sources.popitem(last=False)
+                    stale += self._evict(evicted)
+            else:
+                # opened by another thread meanwhile
+                self._sources.move_to_end(uri)
+            pooled.readers += 1
+        if source is not None:
+            source.close()
+        for evicted in stale:
+            evicted.source.close()
+        return pooled
+
+    def _release(self, pooled):
+        with self._lock:
+            pooled.readers -= 1
+            stale = pooled.evicted and pooled.readers == 0
+            if stale:
+                self._open_stats['closed'] += 1
+        if stale:
+            pooled.source.close()
+
+    def _evict(self, pooled):
+        """Mark a file removed from the pool, returned to be closed if no read uses it, otherwise the last read
+        closes it. Called with self._lock held."""
+        pooled.evicted = True
+        if pooled.readers:
+            return []
+        self._open_stats['closed'] += 1
+        return [pooled]
+
+    def close(self):
+        """Stop read-ahead and decode threads and close all open files, files in use are closed by their reads."""
+        self._shutdown_executors()
+        stale = []
+        with self._lock:
+            while self._sources:
+                _, pooled = self._sources.popitem(last=False)
+                stale += self._evict(pooled)
+        for pooled in stale:
+            pooled.source.close()
+
+
 def rewrite_vlen_to_fixed(filename: str, group: str = None, update_references=False):
     """  Scan hdf5 file or hdf5 group object and recursively convert variable-length string dataset to fixed-length
     Args:
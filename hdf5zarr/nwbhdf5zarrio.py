@@ -1,27 +1,69 @@
 import zarr
+import numpy as np
+import h5py
 from collections.abc import MutableMapping
-from collections import deque
+from collections import deque, OrderedDict
 from functools import partial
+from copy import deepcopy
 from hdmf.utils import call_docval_func, docval, popargs, getargs
 from hdmf.backends.hdf5 import HDF5IO as _HDF5IO
 from hdmf.build import BuildManager, TypeMap, GroupBuilder, LinkBuilder, DatasetBuilder, ReferenceBuilder
 from hdmf.query import HDMFDataset
 from hdmf.query import Array as HDMFArray
 from hdmf.backends.hdf5.h5_utils import BuilderH5ReferenceDataset, BuilderH5TableDataset, H5SpecReader
+from hdmf.backends.hdf5.h5_utils import ContainerH5ReferenceDataset, ContainerH5TableDataset
 from hdmf.backends.warnings import BrokenLinkWarning
 from hdmf.backends.io import UnsupportedOperation
 from hdmf.spec import NamespaceCatalog
 from pynwb import get_manager, get_type_map
+import pynwb
+import hdmf
 import os
+import hashlib
+import pickle
 from warnings import warn
 import logging
 
 HDMFDataset.register(zarr.Array)
 
-from .hdf5zarr import SYMLINK
+from .hdf5zarr import SYMLINK, REFERENCES, address_meta_key, _path_to_prefix, _AddressIndex
 ROOT_NAME = 'root'
 SPEC_LOC_ATTR = '.specloc'
 
+# type maps with loaded cached namespaces, by digest of the cached specs, least recently used first
+_type_map_cache = OrderedDict()
+# number of type maps kept in memory
+TYPE_MAP_CACHE_SIZE = 16
+
+
+def _get_path(root, path):
+    """ object at a path recorded in the hierarchy, e.g. a link target or an object reference. recorded paths are
+    absolute hdf5 paths, they are looked up from the root of the hierarchy, which may be at a store_path of its store
+    """
+    return root[path.lstrip('/')]
+
+
+def _hdf5_path(root, obj):
+    """ absolute hdf5 path of a zarr object in the hierarchy at root, as recorded in the hierarchy """
+    return '/' + obj.path[len(root.path):].strip('/')
+
+
+def _spec_digest(spec_group):
+    """ sha256 of the specs cached in the file and the versions of pynwb and hdmf that parse them """
+    h = hashlib.sha256(f'pynwb {pynwb.__version__} hdmf {hdmf.__version__}'.encode('utf-8'))
+    for ns in sorted(spec_group.group_keys()):
+        for version in sorted(spec_group[ns].group_keys()):
+            version_group = spec_group[ns][version]
+            for name in sorted(version_group.array_keys()):
+                s = version_group[name][()]
+                if isinstance(s, np.ndarray) and s.shape == (1,):
+                    s = s[0]
+                if isinstance(s, str):
+                    s = s.encode('utf-8')
+                h.update(f'\0{ns}/{version}/{name}\0'.encode('utf-8'))
+                h.update(bytes(s))
+    return h.hexdigest()
+
 
 class ZarrSpecReader(H5SpecReader):
 
@@ -34,6 +76,141 @@ class ZarrSpecReader(H5SpecReader):
         self._H5SpecReader__cache = None
 
 
+class LazyGroupBuilder(GroupBuilder):
+    """ GroupBuilder that reads its subgroups, datasets and links on first access """
+
+    def __init__(self, name, read_members, **kwargs):
+        """
+        Args:
+          name:           str, name of the group
+          read_members:   callable returning a dict with 'groups', 'datasets' and 'links' dicts of builders
+          kwargs:         attributes, parent and source, passed to GroupBuilder
+        """
+        self.__read_members = None
+        super().__init__(name, **kwargs)
+        self.__read_members = read_members
+
+    def __materialize(self):
+        read_members = self.__read_members
+        if read_members is not None:
+            self.__read_members = None
+            members = read_members()
+            for builder in members['groups'].values():
+                self.set_group(builder)
+            for builder in members['datasets'].values():
+                if builder is not None:
+                    self.set_dataset(builder)
+            for builder in members['links'].values():
+                self.set_link(builder)
+
+    @property
+    def materialized(self):
+        """ Whether subgroups, datasets and links were read """
+        return self.__read_members is None
+
+    @property
+    def obj_type(self):
+        self.__materialize()
+        return self.__obj_type
+
+    @obj_type.setter
+    def obj_type(self, val):
+        self.__obj_type = val
+
+    @property
+    def groups(self):
+        self.__materialize()
+        return super().groups
+
+    @property
+    def datasets(self):
+        self.__materialize()
+        return super().datasets
+
+    @property
+    def links(self):
+        self.__materialize()
+        return super().links
+
+
+class AddressResolverMixin(object):
+    """ resolve object references stored as hdf5 object addresses with the address index of the hierarchy,
+    all references of a selection are resolved at once and each referenced object is read once
+    """
+
+    def _resolve(self, addresses):
+        addresses = np.asarray(addresses, dtype='uint64')
+        unique, inverse = np.unique(addresses, return_inverse=True)
+        objs = np.empty(len(unique), dtype=object)
+        for i, path in enumerate(self.io.resolve_addresses(unique)):
+            if path is not None:
+                objs[i] = self.get_object(_get_path(self.io._file, path))
+        return objs[inverse].reshape(addresses.shape)
+
+    def _get_ref(self, ref):
+        return self._resolve(ref)[()]
+
+
+class AddressReferenceDataset(AddressResolverMixin):
+
+    def __getitem__(self, arg):
+        refs = self.dataset[arg]
+        if isinstance(refs, np.ndarray):
+            return list(self._resolve(refs))
+        return self._get_ref(refs)
+
+
+class AddressTableDataset(AddressResolverMixin):
+
+    def __getitem__(self, arg):
+        rows = self.dataset[arg]
+        ref_names = [name for name, t in zip(rows.dtype.names, self.types) if t is h5py.Reference]
+        if not ref_names:
+            return rows
+        dtype = [(name, object if name in ref_names else rows.dtype[name]) for name in rows.dtype.names]
+        ret = np.empty(rows.shape, dtype=dtype)
+        for name in rows.dtype.names:
+            ret[name] = self._resolve(rows[name]) if name in ref_names else rows[name]
+        return ret[()] if ret.ndim == 0 else ret
+
+    @property
+    def dtype(self):
+        return ['object' if t is h5py.Reference else self.dataset.dtype[i].type.__name__
+                for i, t in enumerate(self.types)]
+
+
+class BuilderZarrReferenceDataset(AddressReferenceDataset, BuilderH5ReferenceDataset):
+    """ reference dataset of a zarr hierarchy that returns resolved references as Builders """
+
+    @classmethod
+    def get_inverse_class(cls):
+        return ContainerZarrReferenceDataset
+
+
+class ContainerZarrReferenceDataset(AddressReferenceDataset, ContainerH5ReferenceDataset):
+    """ reference dataset of a zarr hierarchy that returns resolved references as Containers """
+
+    @classmethod
+    def get_inverse_class(cls):
+        return BuilderZarrReferenceDataset
+
+
+class BuilderZarrTableDataset(AddressTableDataset, BuilderH5TableDataset):
+    """ compound dataset of a zarr hierarchy that returns resolved references as Builders """
+
+    @classmethod
+    def get_inverse_class(cls):
+        return ContainerZarrTableDataset
+
+
+class ContainerZarrTableDataset(AddressTableDataset, ContainerH5TableDataset):
+    """ compound dataset of a zarr hierarchy that returns resolved references as Containers """
+
+    @classmethod
+    def get_inverse_class(cls):
+        return BuilderZarrTableDataset
+
+
 class NWBZARRHDF5IO(_HDF5IO):
 
     @docval({'name': 'path', 'type': str, 'doc': 'the path to the HDF5 file', 'default': None},
@@ -49,10 +226,20 @@ class NWBZARRHDF5IO(_HDF5IO):
             {'name': 'file', 'type': MutableMapping, 'doc': 'a pre-existing MutableMapping object', 'default': None},
             {'name': 'comm', 'type': "Intracomm", 'doc': 'the MPI communicator to use for parallel I/O',
              'default': None},
+            {'name': 'namespace_cache', 'type': str,
+             'doc': ('directory to keep type maps of loaded namespaces in, in addition to the cache in memory. '
+                     'files of identical cached specs share one type map'),
+             'default': None},
+            {'name': 'lazy', 'type': bool,
+             'doc': ('whether to read the members of a group only when they are accessed, e.g. to construct '
+                     'one container with io.manager.construct(io.read_builder()[path])'),
+             'default': False},
             enforce_type=False, allow_extra=True)
     def __init__(self, **kwargs):
-        path, mode, manager, extensions, load_namespaces, file_obj, comm =\
-            popargs('path', 'mode', 'manager', 'extensions', 'load_namespaces', 'file', 'comm', kwargs)
+        path, mode, manager, extensions, load_namespaces, file_obj, comm, namespace_cache, lazy =\
+            popargs('path', 'mode', 'manager', 'extensions', 'load_namespaces', 'file', 'comm', 'namespace_cache',
+                    'lazy', kwargs)
+        self.__lazy = lazy
 
         # root group
         self.__rgroup = file_obj
@@ -69,6 +256,13 @@ class NWBZARRHDF5IO(_HDF5IO):
         self.__rgroup.filename = filename
 
         file_obj = self.__set_rgroup(file_obj)
+        # hierarchies listing object references, older hierarchies are read by guessing references
+        self.__ref_markers = REFERENCES in file_obj.attrs
+        # hierarchies with an address index resolve references stored as hdf5 object addresses
+        self.__address_key = _path_to_prefix(file_obj.path) + address_meta_key
+        if self.__address_key not in file_obj.store:
+            self.__address_key = None
+        self.__address_index = None
 
         self.__built = dict()       # keep track of each builder for each dataset/group/link for each file
         self.__read = dict()        # keep track of which files have been read. Key is the filename value is the builder
@@ -83,8 +277,7 @@ class NWBZARRHDF5IO(_HDF5IO):
             if 'w' in mode or mode == 'x':
                 raise ValueError("cannot load namespaces from file when writing to it")
 
-            tm = get_type_map()
-            self.load_namespaces(tm, path, file=file_obj)
+            tm = self.__cached_type_map(path, file_obj, namespace_cache)
             manager = BuildManager(tm)
 
             # XXX: Leaving this here in case we want to revert to this strategy for
@@ -142,7 +335,7 @@ class NWBZARRHDF5IO(_HDF5IO):
         ignore = set()
         specloc = self.__file.attrs.get(SPEC_LOC_ATTR)
         if specloc is not None:
-            ignore.add(self.__file[specloc].name)
+            ignore.add(_get_path(self.__file, specloc).name)
         if f_builder is None:
             f_builder = self.__read_group(self.__file, ROOT_NAME, ignore=ignore)
             self.__read[self.__file.name] = f_builder
@@ -173,6 +366,49 @@ class NWBZARRHDF5IO(_HDF5IO):
 
         return self.__load_namespaces(namespace_catalog, namespaces, file_obj)
 
+    def __cached_type_map(self, path, file_obj, cache_dir):
+        """
+        Get a TypeMap with the cached namespaces of the file loaded. Files with identical cached specs share
+        the parsed namespaces, kept in memory for the TYPE_MAP_CACHE_SIZE most recently opened specs and,
+        if cache_dir is given, pickled in cache_dir. Each io gets a copy, a few milliseconds, since reading
+        registers generated container classes in its type map
+        """
+        if SPEC_LOC_ATTR not in file_obj.attrs:
+            tm = get_type_map()
+            self.load_namespaces(tm, path, file=file_obj)
+            return tm
+
+        digest = _spec_digest(_get_path(file_obj, file_obj.attrs[SPEC_LOC_ATTR]))
+        tm = _type_map_cache.pop(digest, None)
+        cache_file = None if cache_dir is None else os.path.join(cache_dir, digest + '.pkl')
+        if tm is None and cache_file is not None and os.path.exists(cache_file):
+            try:
+                with open(cache_file, 'rb') as f:
+                    tm = pickle.load(f)
+            except Exception:
+                print(f"Namespace cache {cache_file} is not readable, loading namespaces from file")
+        if tm is None:
+            tm = get_type_map()
+            self.load_namespaces(tm, path, file=file_obj)
+            if cache_file is not None:
+                try:
+                    data = pickle.dumps(tm)
+                except Exception as e:
+                    # e.g. container classes generated with pynwb.get_class in this process
+                    print(f"Namespace cache {cache_file} is not written, type map is not picklable: {e}")
+                else:
+                    os.makedirs(cache_dir, exist_ok=True)
+                    # write to a temporary file, other processes may read the cache
+                    tmp_file = f'{cache_file}.{os.getpid()}'
+                    with open(tmp_file, 'wb') as f:
+                        f.write(data)
+                    os.replace(tmp_file, cache_file)
+        _type_map_cache[digest] = tm
+        while len(_type_map_cache) > TYPE_MAP_CACHE_SIZE:
+            _type_map_cache.popitem(last=False)
+        # container classes generated while reading are registered in the type map of the io
+        return deepcopy(tm)
+
     def __load_namespaces(self, namespace_catalog, namespaces, file_obj):
         d = {}
 
@@ -181,7 +417,7 @@ class NWBZARRHDF5IO(_HDF5IO):
             warn(msg)
             return d
 
-        spec_group = file_obj[file_obj.attrs[SPEC_LOC_ATTR]]
+        spec_group = _get_path(file_obj, file_obj.attrs[SPEC_LOC_ATTR])
 
         if namespaces is None:
             namespaces = list(spec_group.keys())
@@ -221,6 +457,41 @@ class NWBZARRHDF5IO(_HDF5IO):
 
         return d
 
+    def resolve_addresses(self, addresses):
+        """
+        Look up the paths of hdf5 objects in the address index of the hierarchy
+
+        :param addresses: hdf5 object addresses, 0 for null references
+        :type addresses: array-like of uint64
+
+        :return: numpy object array of paths, None for null references and addresses not in the index
+        """
+        if self.__address_key is None:
+            raise ValueError("%s has no address index, recreate the hierarchy with HDF5Zarr"
+                             % self.__file.filename)
+        if self.__address_index is None:
+            self.__address_index = _AddressIndex(self.__file.store[self.__address_key])
+        return self.__address_index.resolve(addresses)
+
+    @docval({'name': 'h5obj', 'type': (zarr.Array, zarr.Group),
+             'doc': 'the zarr object to get the corresponding Builder object for'})
+    def get_builder(self, **kwargs):
+        """
+        Get the builder for the corresponding zarr Group or Array, reading it if it has not been built
+        """
+        h5obj = getargs('h5obj', kwargs)
+        return self.__read_ref(h5obj)
+
+    @docval({'name': 'h5obj', 'type': (zarr.Array, zarr.Group),
+             'doc': 'the zarr object to get the corresponding Container object for'})
+    def get_container(self, **kwargs):
+        """
+        Get the container for the corresponding zarr Group or Array
+        """
+        h5obj = getargs('h5obj', kwargs)
+        builder = self.get_builder(h5obj)
+        return self.manager.construct(builder)
+
     def __set_rgroup(self, obj):
         obj.file = self.__rgroup
         obj.id = obj.name
@@ -259,15 +530,26 @@ class NWBZARRHDF5IO(_HDF5IO):
             return None
 
     def __read_group(self, h5obj, name=None, ignore=set()):
+        attributes = self.__read_attrs(h5obj)
+
+        if name is None:
+            name = str(os.path.basename(h5obj.name))
+        if self.__lazy:
+            ret = LazyGroupBuilder(name, partial(self.__read_members, h5obj, ignore=ignore),
+                                   attributes=attributes, source=h5obj.file.filename)
+        else:
+            ret = GroupBuilder(name, attributes=attributes, source=h5obj.file.filename,
+                               **self.__read_members(h5obj, ignore=ignore))
+        ret.written = True
+        return ret
+
+    def __read_members(self, h5obj, ignore=set()):
         kwargs = {
-            "attributes": self.__read_attrs(h5obj),
             "groups": dict(),
             "datasets": dict(),
             "links": dict()
         }
 
-        if name is None:
-            name = str(os.path.basename(h5obj.name))
         for k in h5obj:
             sub_h5obj = h5obj.get(k)
             sub_h5obj = self.__set_rgroup(sub_h5obj)
@@ -281,11 +563,11 @@ class NWBZARRHDF5IO(_HDF5IO):
                     # Reading links might be better suited in its own function
                     # get path of link (the key used for tracking what's been built)
 
-                    target_path = sub_h5obj[SYMLINK].attrs[sub_h5obj.name]
+                    target_path = sub_h5obj[SYMLINK].attrs[_hdf5_path(self.__rgroup, sub_h5obj)]
                     builder_name = os.path.basename(target_path)
                     parent_loc = os.path.dirname(target_path)
                     # get builder if already read, else build it
-                    target_obj = sub_h5obj.file[target_path]
+                    target_obj = _get_path(sub_h5obj.file, target_path)
                     target_obj = self.__set_rgroup(target_obj)
 
                     builder = self.__get_built(sub_h5obj.file.filename, target_obj.id)
@@ -320,10 +602,7 @@ class NWBZARRHDF5IO(_HDF5IO):
                 kwargs['datasets'][k] = None
                 continue
 
-        kwargs['source'] = h5obj.file.filename
-        ret = GroupBuilder(name, **kwargs)
-        ret.written = True
-        return ret
+        return kwargs
 
     def __read_dataset(self, h5obj, name=None):
 
@@ -338,18 +617,23 @@ class NWBZARRHDF5IO(_HDF5IO):
             name = str(os.path.basename(h5obj.name))
         kwargs['source'] = h5obj.file.filename
         ndims = len(h5obj.shape)
+        # object reference data recorded in the hierarchy
+        ref_data = h5obj.attrs.get(REFERENCES, {}).get('data') if self.__ref_markers else None
         if ndims == 0:                                       # read scalar
-            scalar = h5obj[()]
-            if isinstance(scalar, bytes):
-                scalar = scalar.decode('UTF-8')
-
-            # TO DO Reference #
             deref_obj = None
-            if isinstance(scalar, str) and scalar != '':
-                try:
-                    deref_obj = h5obj.file[scalar]
-                except:
-                    pass
+            if isinstance(ref_data, str):
+                deref_obj = _get_path(h5obj.file, ref_data)
+            else:
+                scalar = h5obj[()]
+                if isinstance(scalar, bytes):
+                    scalar = scalar.decode('UTF-8')
+
+                # TO DO Reference #
+                if not self.__ref_markers and isinstance(scalar, str) and scalar != '':
+                    try:
+                        deref_obj = _get_path(h5obj.file, scalar)
+                    except:
+                        pass
             if deref_obj is not None:
                 # TODO (AJTRITT):  This should call __read_ref to support Group references
                 target = deref_obj
@@ -369,14 +653,25 @@ class NWBZARRHDF5IO(_HDF5IO):
                 if isinstance(elem1, (str, bytes)):
                     d = h5obj
             # TO DO #
-            elif h5obj.dtype == 'uint64' and len(h5obj) > 0:
-                d = BuilderH5ReferenceDataset(HDMFArray(h5obj), self)  # read list of references
+            elif (h5obj.dtype == 'uint64' and len(h5obj) > 0 and
+                  (ref_data is True or not self.__ref_markers)):
+                if self.__address_key is not None:
+                    d = BuilderZarrReferenceDataset(HDMFArray(h5obj), self)
+                else:
+                    d = BuilderH5ReferenceDataset(HDMFArray(h5obj), self)  # read list of references
                 # TO DO Region Reference #
             elif h5obj.dtype.kind == 'V':    # table
                 cpd_dt = h5obj.dtype
-                # TO DO check_dtype #
-                ref_cols = [cpd_dt[i] == 'uint64' for i in range(len(cpd_dt))]
-                d = BuilderH5TableDataset(HDMFArray(h5obj), self, ref_cols)
+                if self.__ref_markers:
+                    ref_cols = [name in (ref_data or ()) for name in cpd_dt.names]
+                else:
+                    # TO DO check_dtype #
+                    ref_cols = [cpd_dt[i] == 'uint64' for i in range(len(cpd_dt))]
+                if self.__address_key is not None:
+                    types = [h5py.Reference if ref else cpd_dt[i].type for i, ref in enumerate(ref_cols)]
+                    d = BuilderZarrTableDataset(HDMFArray(h5obj), self, types)
+                else:
+                    d = BuilderH5TableDataset(HDMFArray(h5obj), self, ref_cols)
             else:
                 d = h5obj
             kwargs["data"] = d
@@ -388,12 +683,19 @@ class NWBZARRHDF5IO(_HDF5IO):
 
     def __read_attrs(self, h5obj):
         ret = dict()
-        for k, v in h5obj.attrs.items():
+        attrs = dict(h5obj.attrs.asdict())
+        ref_attrs = attrs.pop(REFERENCES, {}).get('attributes', [])
+        for k, v in attrs.items():
             if k == SPEC_LOC_ATTR:     # ignore cached spec
                 continue
-            if isinstance(v, str) and v != '':
+            if self.__ref_markers:
+                if k in ref_attrs:
+                    ret[k] = self.__read_ref(_get_path(h5obj.file, v))
+                else:
+                    ret[k] = v
+            elif isinstance(v, str) and v != '':
                 try:
-                    deref_obj = h5obj.file[v]
+                    deref_obj = _get_path(h5obj.file, v)
                 except:
                     deref_obj = None
                 if deref_obj is not None:
@@ -0,0 +1,296 @@
+import json
+import base64
+import math
+import zarr
+import fsspec
+import numpy as np
+from pathlib import PurePosixPath
+from zarr.util import json_dumps, json_loads
+from numcodecs.compat import ensure_bytes
+from .hdf5zarr import HDF5Zarr, DecodedMetadataStore, chunks_meta_key, address_meta_key, chunkstats_meta_key
+from .hdf5zarr import intervals_meta_key, _path_to_prefix
+
+# zarr metadata keys, the object address index, chunk statistics and interval indexes, exported as json strings
+_meta_names = ('.zgroup', '.zarray', '.zattrs', address_meta_key, chunkstats_meta_key, intervals_meta_key)
+
+
+def export_references(source, out: str = None, format: str = 'json', uri: str = None, record_size: int = 10000):
+    """ Export an HDF5Zarr hierarchy as kerchunk references, readable with fsspec ReferenceFileSystem.
+    Each chunk key maps to [uri, offset, size] in the hdf5 file. Short uncompressed chunks at the end of
+    contiguous datasets and chunks copied to the store are inlined, datasets with variable-length strings read from
+    the file are not exported.
+    Args:
+      source:         HDF5Zarr object or zarr.Group of an HDF5Zarr hierarchy
+      out:            str, output location. None returns the references as a dict, format 'json' only
+      format:         str, 'json', references version 1 json file
+                           'parquet', directory of parquet reference files, requires pandas
+                           and pyarrow or fastparquet
+      uri:            str, location of the hdf5 file written in the references, e.g. its remote url.
+                      default is the file the hierarchy was created from
+      record_size:    int, number of references per parquet file
+    Returns:
+      dict of references if out is None
+    """
+    if format not in ('json', 'parquet'):
+        raise ValueError("format must be 'json' or 'parquet'")
+    if not isinstance(record_size, int):
+        raise TypeError(f"Expected int for record_size, recieved {type(record_size)}")
+    if isinstance(source, HDF5Zarr):
+        store = source.store
+        prefix = _path_to_prefix(source.zgroup.path)
+        chunk_store = source.chunk_store
+    elif isinstance(source, zarr.Group):
+        store = source.store
+        prefix = _path_to_prefix(source.path)
+        chunk_store = source.chunk_store
+    else:
+        raise TypeError(f"Expected HDF5Zarr or zarr.Group for source, recieved {type(source)}")
+    if isinstance(store, DecodedMetadataStore):
+        # export the compressor of arrays
+        store = store.store
+
+    metadata = dict()
+    for key in store:
+        if key.startswith(prefix) and PurePosixPath(key).name in _meta_names + (chunks_meta_key,):
+            value = store[key]
+            metadata[key[len(prefix):]] = json_loads(value) if isinstance(value, bytes) else value
+
+    refs = dict()
+    for key in sorted(metadata):
+        if key.endswith(chunks_meta_key):
+            continue
+        path = str(PurePosixPath(key).parent)
+        zchunks = metadata.get(_path_to_prefix('' if path == '.' else path) + chunks_meta_key)
+        if zchunks is not None and any('gcol_offsets' in v for k, v in zchunks.items() if k != 'source'):
+            print(f"Dataset {zchunks['source']['array_name']} is not exported: variable-length strings")
+            continue
+        refs[key] = json_dumps(metadata[key]).decode('utf-8')
+        if PurePosixPath(key).name != '.zarray':
+            continue
+        if zchunks is None:
+            # chunks copied to the store, e.g. inlined small datasets
+            array_prefix = _path_to_prefix('' if path == '.' else path)
+            for name in zarr.storage.listdir(store, (prefix + array_prefix).rstrip('/')):
+                if not name.startswith('.'):
+                    data = ensure_bytes(store[prefix + array_prefix + name])
+                    refs[array_prefix + name] = 'base64:' + base64.b64encode(data).decode('ascii')
+            continue
+
+        zarray_meta = metadata[key]
+        dtype = zarray_meta['dtype']
+        if isinstance(dtype, list):
+            dtype = [tuple(el) for el in dtype]
+        chunksize = int(np.prod(zarray_meta['chunks']))*np.dtype(dtype).itemsize
+        padded = zarray_meta['compressor'] is None and not zarray_meta.get('filters')
+        chunk_uri = uri or zchunks['source']['uri']
+        for chunk_key, loc in zchunks.items():
+            if chunk_key == 'source':
+                continue
+            if padded and loc['size'] < chunksize:
+                # zarr expects uncompressed chunks of full size
+                data = chunk_store[chunk_key]
+                refs[chunk_key[len(prefix):]] = 'base64:' + base64.b64encode(data).decode('ascii')
+            else:
+                refs[chunk_key[len(prefix):]] = [chunk_uri, loc['offset'], loc['size']]
+
+    references = {'version': 1, 'refs': refs}
+    if format == 'parquet':
+        if out is None:
+            raise ValueError("out is required for parquet references")
+        _write_parquet_references(refs, out, record_size)
+    elif out is None:
+        return references
+    else:
+        with fsspec.open(out, mode='w') as f:
+            json.dump(references, f)
+
+
+def _chunk_grid(zarray_meta):
+    # number of chunks along each axis, one chunk for scalars
+    return [math.ceil(s/c) for s, c in zip(zarray_meta['shape'], zarray_meta['chunks'])] or [1]
+
+
+def _write_parquet_references(refs, out, record_size):
+    try:
+        import pandas as pd
+    except ImportError:
+        raise ImportError("parquet references require pandas, install it with 'pip install pandas pyarrow'")
+
+    fs, root = fsspec.core.url_to_fs(out)
+    fs.makedirs(root, exist_ok=True)
+    metadata = dict()
+    fields = dict()
+    for key, value in refs.items():
+        if PurePosixPath(key).name in _meta_names:
+            metadata[key] = json.loads(value)
+        else:
+            field, chunk_index = key.rsplit('/', 1)
+            fields.setdefault(field, []).append((chunk_index, value))
+
+    for field, chunks in fields.items():
+        grid = _chunk_grid(metadata[field + '/.zarray'])
+        nchunks = int(np.prod(grid))
+        records = dict()
+        for chunk_index, value in chunks:
+            number = int(np.ravel_multi_index([int(i) for i in chunk_index.split('.')], grid))
+            records.setdefault(number // record_size, []).append((number % record_size, value))
+        fs.makedirs(f'{root}/{field}', exist_ok=True)
+        for record, rows in records.items():
+            n = min(record_size, nchunks - record*record_size)
+            paths = np.full(n, None, dtype=object)
+            offsets = np.zeros(n, dtype='int64')
+            sizes = np.zeros(n, dtype='int64')
+            raws = np.full(n, None, dtype=object)
+            for row, value in rows:
+                if isinstance(value, list):
+                    paths[row], offsets[row], sizes[row] = value
+                else:
+                    raws[row] = _inline_bytes(value)
+            df = pd.DataFrame({'path': paths, 'offset': offsets, 'size': sizes, 'raw': raws})
+            with fs.open(f'{root}/{field}/refs.{record}.parq', mode='wb') as f:
+                df.to_parquet(f, index=False)
+
+    with fs.open(f'{root}/.zmetadata', mode='w') as f:
+        json.dump({'metadata': metadata, 'record_size': record_size}, f)
+
+
+def _inline_bytes(value):
+    if isinstance(value, bytes):
+        return value
+    if value.startswith('base64:'):
+        return base64.b64decode(value[len('base64:'):])
+    return value.encode('utf-8')
+
+
+def load_references(references):
+    """ Read kerchunk references
+    Args:
+      references:     dict, or str location of a json reference file or a parquet reference directory
+    Returns:
+      dict mapping keys to json metadata strings, [uri], [uri, offset, size] or inline data
+    """
+    if isinstance(references, str):
+        fs, root = fsspec.core.url_to_fs(references)
+        if fs.isdir(root):
+            return _read_parquet_references(fs, root)
+        with fs.open(root, mode='r') as f:
+            references = json.load(f)
+    if not isinstance(references, dict):
+        raise TypeError(f"Expected dict or str for references, recieved {type(references)}")
+
+    if 'refs' not in references:
+        # version 0
+        return dict(references)
+    if references.get('gen'):
+        raise ValueError("generated references are not supported")
+    refs = dict(references['refs'])
+    templates = references.get('templates', {})
+    if templates:
+        for key, value in refs.items():
+            if isinstance(value, list) and '{{' in value[0]:
+                target = value[0]
+                for name, template in templates.items():
+                    target = target.replace('{{' + name + '}}', template)
+                refs[key] = [target] + value[1:]
+    return refs
+
+
+def _read_parquet_references(fs, root):
+    try:
+        import pandas as pd
+    except ImportError:
+        raise ImportError("parquet references require pandas, install it with 'pip install pandas pyarrow'")
+
+    with fs.open(f'{root}/.zmetadata', mode='r') as f:
+        zmetadata = json.load(f)
+    record_size = zmetadata['record_size']
+    refs = {key: json.dumps(value) for key, value in zmetadata['metadata'].items()}
+    for key, zarray_meta in zmetadata['metadata'].items():
+        if PurePosixPath(key).name != '.zarray':
+            continue
+        field = str(PurePosixPath(key).parent)
+        grid = _chunk_grid(zarray_meta)
+        for record in range(math.ceil(int(np.prod(grid))/record_size)):
+            try:
+                with fs.open(f'{root}/{field}/refs.{record}.parq', mode='rb') as f:
+                    df = pd.read_parquet(f)
+            except FileNotFoundError:
+                continue
+            raws = df['raw'] if 'raw' in df else [None]*len(df)
+            rows = zip(df['path'], df['offset'], df['size'], raws)
+            for row, (path, offset, size, raw) in enumerate(rows):
+                chunk_index = np.unravel_index(record*record_size + row, grid)
+                chunk_key = f'{field}/' + '.'.join(str(i) for i in chunk_index)
+                if raw is not None:
+                    refs[chunk_key] = raw
+                elif isinstance(path, str):
+                    refs[chunk_key] = [path] if offset == 0 and size == 0 else [path, int(offset), int(size)]
+    return refs
+
+
+def references_to_store(references, store=None, store_path: str = None):
+    """ Create an HDF5Zarr hierarchy with file chunk location metadata from kerchunk references
+    Args:
+      references:     dict, or str location of a json reference file or a parquet reference directory
+      store:          collections.abc.MutableMapping or str, zarr store. if string path is passed,
+                      zarr.DirectoryStore is created at the given path, if None, zarr.MemoryStore is used
+      store_path:     string, path in zarr store
+    Returns:
+      zarr store, for FileChunkStore or MultiFileChunkStore
+    """
+    refs = load_references(references)
+    if store is None:
+        store = zarr.MemoryStore()
+    elif isinstance(store, str):
+        store = zarr.DirectoryStore(store)
+    prefix = _path_to_prefix((store_path or '').strip('/'))
+
+    zchunks = dict()
+    for key, value in refs.items():
+        if PurePosixPath(key).name in _meta_names + ('.zmetadata',):
+            if PurePosixPath(key).name != '.zmetadata':
+                store[prefix + key] = json_dumps(json.loads(value) if isinstance(value, (str, bytes)) else value)
+            continue
+        path = str(PurePosixPath(key).parent)
+        path = '' if path == '.' else path
+        if isinstance(value, list):
+            if len(value) == 1:
+                # whole file
+                fs, target = fsspec.core.url_to_fs(value[0])
+                value = [value[0], 0, fs.size(target)]
+            chunks = zchunks.setdefault(path, dict())
+            if chunks.get('source', {'uri': value[0]})['uri'] != value[0]:
+                raise ValueError(f"{path}: chunks of one array must be in one file")
+            chunks['source'] = {'uri': value[0], 'array_name': '/' + path}
+            chunks[prefix + key] = {'offset': int(value[1]), 'size': int(value[2])}
+        else:
+            # inline chunk, read by the chunk store from the metadata store
+            store[prefix + key] = _inline_bytes(value)
+
+    for path, chunks in zchunks.items():
+        store[prefix + _path_to_prefix(path) + chunks_meta_key] = json_dumps(chunks)
+
+    return store
+
+
+def import_references(references, store=None, store_path: str = None, **kwargs):
+    """ Open kerchunk references of one hdf5 file as an HDF5Zarr object
+    Args:
+      references:     dict, or str location of a json reference file or a parquet reference directory
+      store:          collections.abc.MutableMapping or str, zarr store. if string path is passed,
+                      zarr.DirectoryStore is created at the given path, if None, zarr.MemoryStore is used
+      store_path:     string, path in zarr store
+      kwargs:         passed to HDF5Zarr, e.g. prefetch, decode_workers or LRU
+    Returns:
+      HDF5Zarr
+    """
+    store = references_to_store(references, store=store, store_path=store_path)
+    prefix = _path_to_prefix((store_path or '').strip('/'))
+    uris = set()
+    for key in store:
+        if key.startswith(prefix) and key.endswith(chunks_meta_key):
+            uris.add(json_loads(store[key])['source']['uri'])
+    if len(uris) != 1:
+        raise ValueError(f"references point to {len(uris)} files, expected one. "
+                         "Use references_to_store with MultiFileChunkStore")
+    return HDF5Zarr(uris.pop(), store=store, store_path=store_path, store_mode='r', **kwargs)
@@ -0,0 +1,274 @@
+import hashlib
+import zarr
+import numpy as np
+from zarr.storage import array_meta_key
+from zarr.util import json_dumps, json_loads
+from .hdf5zarr import HDF5Zarr, chunks_meta_key, _path_to_prefix
+
+# groups of derived products in a sidecar zarr group
+PYRAMID = 'pyramid'
+SPIKE_COUNTS = 'spike_counts'
+
+
+def open_sidecar(sidecar, mode: str = 'a'):
+    """ Open a sidecar zarr group holding products derived from HDF5Zarr hierarchies
+    Args:
+      sidecar:        zarr.Group, collections.abc.MutableMapping or str, zarr group or store.
+                      if string path is passed, zarr.DirectoryStore is created at the given path
+      mode:           str, zarr access mode, default 'a'
+    Returns:
+      zarr.Group
+    """
+    if isinstance(sidecar, zarr.Group):
+        return sidecar
+    if isinstance(sidecar, str):
+        sidecar = zarr.DirectoryStore(sidecar)
+    return zarr.open_group(sidecar, mode=mode)
+
+
+def fingerprint(source, path: str):
+    """ sha256 of the zarr metadata and file chunk locations of a dataset, identifying the data a derived
+    product was computed from. Chunks copied to the store, e.g. of inlined or materialized datasets, are identified
+    by their keys and sizes, the data is not read.
+    Args:
+      source:         HDF5Zarr object
+      path:           str, path of the dataset in the zarr hierarchy
+    Returns:
+      str
+    """
+    if not isinstance(source, HDF5Zarr):
+        raise TypeError(f"Expected HDF5Zarr for source, recieved {type(source)}")
+    zarray = source._get_zarray(path)
+    prefix = _path_to_prefix(zarray.path)
+    h = hashlib.sha256()
+    for key in (array_meta_key, chunks_meta_key):
+        try:
+            value = source.store[prefix + key]
+            value = json_loads(value) if isinstance(value, bytes) else value
+        except KeyError:
+            # chunks copied to the store
+            value = {name: zarr.storage.getsize(source.store, prefix + name)
+                     for name in zarr.storage.listdir(source.store, zarray.path) if not name.startswith('.')}
+        h.update(json_dumps(value))
+    return h.hexdigest()
+
+
+class _PyramidLevel(object):
+    """ min, max and mean of bins of factor elements of the level below, written in order """
+
+    def __init__(self, group, length, shape, dtype, mean_dtype, factor):
+        chunk_rows = max(1, 2**20//(int(np.prod(shape))*np.dtype(mean_dtype).itemsize))
+        chunks = (min(chunk_rows, length),) + shape
+        self.min = group.zeros('min', shape=(length,) + shape, chunks=chunks, dtype=dtype, overwrite=True)
+        self.max = group.zeros('max', shape=(length,) + shape, chunks=chunks, dtype=dtype, overwrite=True)
+        self.mean = group.zeros('mean', shape=(length,) + shape, chunks=chunks, dtype=mean_dtype, overwrite=True)
+        self.factor = factor
+        self.pos = 0
+        self.carry = None
+
+    def push(self, mins, maxs, sums, counts, final=False):
+        """ Add elements of the level below, returns the complete bins as min, max, sum and count """
+        if self.carry is not None:
+            mins, maxs, sums, counts = (np.concatenate((c, x))
+                                        for c, x in zip(self.carry, (mins, maxs, sums, counts)))
+        n = len(counts)//self.factor*self.factor
+        bins = self._reduce(mins[:n], maxs[:n], sums[:n], counts[:n], self.factor)
+        self.carry = (mins[n:], maxs[n:], sums[n:], counts[n:])
+        if final and n < len(counts):
+            # last partial bin
+            last = self._reduce(*self.carry, len(counts) - n)
+            bins = tuple(np.concatenate((b, x)) for b, x in zip(bins, last))
+            self.carry = None
+        self._write(*bins)
+        return bins
+
+    @staticmethod
+    def _reduce(mins, maxs, sums, counts, factor):
+        m = len(counts)//factor
+        shape = (m, factor) + mins.shape[1:]
+        return (mins.reshape(shape).min(axis=1), maxs.reshape(shape).max(axis=1),
+                sums.reshape(shape).sum(axis=1, dtype='float64'), counts.reshape(m, factor).sum(axis=1))
+
+    def _write(self, mins, maxs, sums, counts):
+        n = len(counts)
+        if not n:
+            return
+        sel = slice(self.pos, self.pos + n)
+        self.min[sel] = mins
+        self.max[sel] = maxs
+        self.mean[sel] = sums/counts.reshape((n,) + (1,)*(sums.ndim - 1))
+        self.pos += n
+
+
+def build_pyramid(source, path: str, sidecar, factor: int = 4, min_samples: int = 1024,
+                  block_bytes: int = 64*2**20):
+    """ Build decimated levels of a time series dataset, read once in blocks along the first axis.
+    Level n holds min, max and mean of bins of factor**n samples, levels are added while they have at
+    least min_samples bins. Levels are stored in the sidecar group at 'pyramid/<path>/<n>/{min,max,mean}',
+    an existing pyramid of the dataset is removed first. The fingerprint attribute of the pyramid group is
+    written last, a pyramid without it is incomplete.
+    Args:
+      source:         HDF5Zarr object
+      path:           str, path of the dataset in the zarr hierarchy
+      sidecar:        zarr.Group, collections.abc.MutableMapping or str, sidecar zarr group or store
+      factor:         int, number of elements of a level in a bin of the next level, default 4
+      min_samples:    int, minimum number of bins of a level, default 1024
+      block_bytes:    int, size in bytes of blocks of the dataset read at once, default 64 MiB
+    Returns:
+      zarr.Group of the pyramid
+    """
+    if not isinstance(factor, int) or factor < 2:
+        raise ValueError("factor must be an int larger than 1")
+    if not isinstance(min_samples, int):
+        raise TypeError(f"Expected int for min_samples, recieved {type(min_samples)}")
+    if not isinstance(block_bytes, int):
+        raise TypeError(f"Expected int for block_bytes, recieved {type(block_bytes)}")
+    zarray = source._get_zarray(path)
+    if zarray.ndim == 0 or zarray.dtype.kind not in 'iuf':
+        raise ValueError(f"{path}: pyramids require a numeric dataset with at least one dimension")
+
+    length = zarray.shape[0]
+    lengths = []
+    while -(-length//factor**(len(lengths) + 1)) >= min_samples:
+        lengths.append(-(-length//factor**(len(lengths) + 1)))
+
+    group = open_sidecar(sidecar).create_group(f'{PYRAMID}/{path}', overwrite=True)
+    mean_dtype = np.result_type(zarray.dtype, np.float32)
+    levels = [_PyramidLevel(group.create_group(str(n + 1)), level_length, zarray.shape[1:],
+                            zarray.dtype, mean_dtype, factor)
+              for n, level_length in enumerate(lengths)]
+
+    row_bytes = int(np.prod(zarray.shape[1:]))*zarray.dtype.itemsize
+    block_len = max(1, block_bytes//max(row_bytes, 1))
+    block_len = max(zarray.chunks[0], block_len//zarray.chunks[0]*zarray.chunks[0])
+    for start in range(0, length if levels else 0, block_len):
+        data = zarray[start:start+block_len]
+        final = start + block_len >= length
+        bins = (data, data, data, np.ones(len(data), dtype='int64'))
+        for level in levels:
+            bins = level.push(*bins, final=final)
+
+    group.attrs.update({'factor': factor, 'levels': len(levels), 'shape': list(zarray.shape),
+                        'fingerprint': fingerprint(source, path)})
+    return group
+
+
+def read_pyramid(source, path: str, sidecar, start: int = None, stop: int = None, max_samples: int = 2000):
+    """ Read a range of a time series dataset at the finest resolution with at most max_samples elements,
+    from the dataset or from its pyramid levels, see build_pyramid
+    Args:
+      source:         HDF5Zarr object
+      path:           str, path of the dataset in the zarr hierarchy
+      sidecar:        zarr.Group, collections.abc.MutableMapping or str, sidecar zarr group or store
+      start:          int, first sample along the first axis, default 0
+      stop:           int, end sample along the first axis, default the dataset length
+      max_samples:    int, maximum number of elements returned, e.g. the width of a plot in pixels
+    Returns:
+      dict with 'step', number of samples in each element, 'start', first sample of the first element,
+      and 'min', 'max' and 'mean' numpy.ndarray, the same array if step is 1
+    """
+    zarray = source._get_zarray(path)
+    start, stop, _ = slice(start, stop).indices(zarray.shape[0])
+    stop = max(start, stop)
+    if stop - start <= max_samples:
+        data = zarray[start:stop]
+        return {'step': 1, 'start': start, 'min': data, 'max': data, 'mean': data}
+
+    try:
+        group = open_sidecar(sidecar, mode='r')[f'{PYRAMID}/{path}']
+    except KeyError:
+        raise ValueError(f"{path} has no pyramid, build it with build_pyramid")
+    if 'fingerprint' not in group.attrs:
+        raise ValueError(f"pyramid of {path} is incomplete, rebuild it with build_pyramid")
+    if group.attrs['fingerprint'] != fingerprint(source, path):
+        raise ValueError(f"pyramid of {path} is out of date, rebuild it with build_pyramid")
+    if group.attrs['levels'] == 0:
+        raise ValueError(f"{path} is shorter than the first pyramid level")
+    factor = group.attrs['factor']
+    level = 1
+    while level < group.attrs['levels'] and -(-(stop - start)//factor**level) > max_samples:
+        level += 1
+
+    step = factor**level
+    sel = slice(start//step, -(-stop//step))
+    level_group = group[str(level)]
+    return {'step': step, 'start': sel.start*step,
+            'min': level_group['min'][sel], 'max': level_group['max'][sel], 'mean': level_group['mean'][sel]}
+
+
+def binned_spike_counts(source, bin_size: float, sidecar, units=None, start: float = None, stop: float = None,
+                        path: str = 'units/spike_times', index_path: str = None, units_chunk: int = 64,
+                        bins_chunk: int = 2**14):
+    """ Read spike counts of units in time bins, from a units x bins count matrix cached in the sidecar group.
+    The matrix is computed on first use for a bin size, reading the spike times once in batches of units, and
+    stored compressed at 'spike_counts/<fingerprint>/<bin_size>', fingerprint of the spike times and index datasets.
+    The complete attribute of the matrix is written last, an incomplete matrix is computed again.
+    Bins start at time 0, earlier spikes are not counted.
+    Args:
+      source:         HDF5Zarr object
+      bin_size:       float, bin width in seconds
+      sidecar:        zarr.Group, collections.abc.MutableMapping or str, sidecar zarr group or store
+      units:          int, slice or sequence of int, units (rows of the index dataset) to return, default all
+      start:          float, start time of the returned bins, rounded down to a bin, default 0
+      stop:           float, end time of the returned bins, rounded up to a bin, default end of the last bin
+                      with spikes
+      path:           str, path of the ragged spike times dataset, default 'units/spike_times'
+      index_path:     str, path of the index dataset, default path + '_index'
+      units_chunk:    int, number of units in a chunk of a new count matrix, default 64
+      bins_chunk:     int, number of bins in a chunk of a new count matrix, default 16384
+    Returns:
+      dict with 'bin_size', 'start', start time of the first bin, and 'counts', numpy.ndarray of uint32,
+      units x bins
+    """
+    if not bin_size > 0:
+        raise ValueError("bin_size must be positive")
+    index_path = index_path or path + '_index'
+    h = hashlib.sha256()
+    for dset in (path, index_path):
+        h.update(fingerprint(source, dset).encode('ascii'))
+    name = f'{SPIKE_COUNTS}/{h.hexdigest()}/{float(bin_size)!r}'
+
+    group = open_sidecar(sidecar)
+    if name in group and group[name].attrs.get('complete', False):
+        counts = group[name]
+    else:
+        counts = _write_spike_counts(source, path, index_path, float(bin_size), group, name, units_chunk, bins_chunk)
+
+    rows = np.arange(counts.shape[0])[units if units is not None else slice(None)]
+    first = 0 if start is None else int(np.floor(start/bin_size))
+    last = counts.shape[1] if stop is None else int(np.ceil(stop/bin_size))
+    last = max(first, last)
+    ret = np.zeros((np.size(rows), last - first), dtype=counts.dtype)
+    # bins outside the matrix have no spikes
+    lo, hi = max(first, 0), min(last, counts.shape[1])
+    if hi > lo and np.size(rows):
+        ret[:, lo-first:hi-first] = counts.get_orthogonal_selection((np.atleast_1d(rows), slice(lo, hi)))
+    return {'bin_size': bin_size, 'start': first*bin_size, 'counts': ret[0] if np.ndim(rows) == 0 else ret}
+
+
+def _write_spike_counts(source, path, index_path, bin_size, group, name, units_chunk, bins_chunk):
+    n_units = source._get_zarray(index_path).shape[0]
+    counts = group.zeros(name, shape=(n_units, 0), chunks=(units_chunk, bins_chunk), dtype='uint32',
+                         write_empty_chunks=False, overwrite=True)
+    # one batch of units for each row of chunks
+    for first_unit in range(0, n_units, units_chunk):
+        rows = np.arange(first_unit, min(first_unit + units_chunk, n_units))
+        trains = source.read_ragged(path, rows, index_path=index_path)
+        unit = np.repeat(np.arange(len(rows)), [len(train) for train in trains])
+        bins = np.floor(np.concatenate(trains)/bin_size).astype('int64') if len(unit) else np.array([], 'int64')
+        unit, bins = unit[bins >= 0], bins[bins >= 0]
+        if not len(bins):
+            continue
+        if bins.max() >= counts.shape[1]:
+            counts.resize(n_units, int(bins.max()) + 1)
+        chunk = bins//bins_chunk
+        order = np.argsort(chunk, kind='stable')
+        unit, bins, chunk = unit[order], bins[order], chunk[order]
+        bounds = np.flatnonzero(np.diff(chunk)) + 1
+        for u, b in zip(np.split(unit, bounds), np.split(bins, bounds)):
+            b0 = b[0]//bins_chunk*bins_chunk
+            width = min(bins_chunk, counts.shape[1] - b0)
+            block = np.bincount(u*width + (b - b0), minlength=len(rows)*width).reshape(len(rows), width)
+            counts[rows[0]:rows[-1]+1, b0:b0+width] = block
+    counts.attrs['complete'] = True
+    return counts
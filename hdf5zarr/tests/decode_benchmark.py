@@ -0,0 +1,37 @@
+import os
+import time
+import h5py
+import numpy as np
+from hdf5zarr import HDF5Zarr
+
+# compressed test dataset, ~256 MiB of int16 samples in 1 MiB gzip chunks
+nwbfile_local = 'data/decode_benchmark.h5'
+dset_name = 'acquisition/lfp/data'
+n_samples, n_channels = 2**23, 16
+repeat = 3
+
+if not os.path.exists(nwbfile_local):
+    os.makedirs(os.path.dirname(nwbfile_local), exist_ok=True)
+    rng = np.random.default_rng(0)
+    with h5py.File(nwbfile_local, mode='w') as hfile:
+        dset = hfile.create_dataset(dset_name, shape=(n_samples, n_channels), dtype='int16',
+                                    chunks=(2**15, n_channels), compression='gzip')
+        for i in range(0, n_samples, 2**20):
+            t = np.arange(i, i+2**20)[:, None]
+            dset[i:i+2**20] = (np.sin(t/200.)*500 + rng.normal(scale=20, size=(2**20, n_channels))).astype('int16')
+
+with h5py.File(nwbfile_local, mode='r') as hfile:
+    dset_nbytes = hfile[dset_name].size*hfile[dset_name].dtype.itemsize
+
+# read the whole dataset, with zarr decoding chunks and with FileChunkStore decoding on a thread pool
+workers_list = [0] + [n for n in (1, 2, 4, 8, 16, 32) if n <= (os.cpu_count() or 1)]
+for decode_workers in workers_list:
+    hdf5_zarr = HDF5Zarr(nwbfile_local, decode_workers=decode_workers)
+    zarray = hdf5_zarr.zgroup[dset_name]
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        zarray[:]
+        times.append(time.perf_counter() - t0)
+    best = min(times)
+    print(f"decode_workers={decode_workers:<3d} best of {repeat}: {best:.3f} s, {dset_nbytes/best/2**20:.1f} MiB/s")
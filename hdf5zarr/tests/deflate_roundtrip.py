@@ -0,0 +1,31 @@
+import os
+import h5py
+import numpy as np
+from hdf5zarr import HDF5Zarr
+
+# hdf5 deflate chunks are zlib streams, read through the zarr view with zarr and with FileChunkStore decoding
+nwbfile_local = 'data/deflate_roundtrip.h5'
+dset_names = ['deflate', 'deflate_level9', 'deflate_2d']
+
+if not os.path.exists(nwbfile_local):
+    os.makedirs(os.path.dirname(nwbfile_local), exist_ok=True)
+    rng = np.random.default_rng(0)
+    with h5py.File(nwbfile_local, mode='w') as hfile:
+        hfile.create_dataset('deflate', data=np.arange(100000, dtype='int32'), chunks=(4096,),
+                             compression='gzip')
+        hfile.create_dataset('deflate_level9', data=rng.normal(size=50000), chunks=(1000,),
+                             compression='gzip', compression_opts=9)
+        hfile.create_dataset('deflate_2d', data=rng.integers(0, 100, size=(3000, 7), dtype='int16'),
+                             chunks=(256, 7), compression='gzip')
+
+with h5py.File(nwbfile_local, mode='r') as hfile:
+    expected = {name: hfile[name][:] for name in dset_names}
+
+for decode_workers in (0, 2):
+    hdf5_zarr = HDF5Zarr(nwbfile_local, decode_workers=decode_workers)
+    for name in dset_names:
+        zarray = hdf5_zarr.zgroup[name]
+        assert b'"zlib"' in hdf5_zarr.store[f'{name}/.zarray']
+        assert np.array_equal(zarray[:], expected[name])
+        assert np.array_equal(zarray[1234:2345], expected[name][1234:2345])
+        print(f"{name} decode_workers={decode_workers}: ok")
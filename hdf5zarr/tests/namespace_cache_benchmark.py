@@ -0,0 +1,98 @@
+import os
+import sys
+import time
+import shutil
+import pickle
+import subprocess
+from copy import deepcopy
+from datetime import datetime, timezone
+import numpy as np
+from hdf5zarr import HDF5Zarr, NWBZARRHDF5IO
+from hdf5zarr import nwbhdf5zarrio
+
+# file with an extension namespace, read with its cached namespaces
+nwbfile_local = 'data/namespace_cache.nwb'
+namespace_local = 'data/ndx-cache-test/ndx-cache-test.namespace.yaml'
+cache_dir = 'data/namespace_cache'
+repeat = 5
+
+
+def write_file():
+    from pynwb import load_namespaces, get_class, NWBFile, NWBHDF5IO
+    from pynwb.spec import NWBNamespaceBuilder, NWBGroupSpec, NWBAttributeSpec
+    ns = NWBNamespaceBuilder('namespace cache test', 'ndx-cache-test', version='0.1.0', author='a', contact='a@b')
+    ns.include_type('TimeSeries', namespace='core')
+    spec = NWBGroupSpec('gain series', neurodata_type_def='GainSeries', neurodata_type_inc='TimeSeries',
+                        attributes=[NWBAttributeSpec('gain', 'gain', 'float')])
+    ns.add_spec('ndx-cache-test.extensions.yaml', spec)
+    os.makedirs(os.path.dirname(namespace_local), exist_ok=True)
+    ns.export(os.path.basename(namespace_local), outdir=os.path.dirname(namespace_local))
+    load_namespaces(namespace_local)
+    GainSeries = get_class('GainSeries', 'ndx-cache-test')
+    nwb = NWBFile('namespace cache', 'session', datetime(2020, 1, 1, tzinfo=timezone.utc))
+    nwb.add_acquisition(GainSeries(name='gain_series', data=np.arange(10.), unit='V', rate=1., gain=2.5))
+    with NWBHDF5IO(nwbfile_local, 'w') as io:
+        io.write(nwb)
+
+
+def read_file(namespace_cache=None):
+    hdf5_zarr = HDF5Zarr(nwbfile_local)
+    t0 = time.perf_counter()
+    io = NWBZARRHDF5IO(mode='r', file=hdf5_zarr.zgroup, load_namespaces=True, namespace_cache=namespace_cache)
+    t1 = time.perf_counter()
+    gain_series = io.read().acquisition['gain_series']
+    assert type(gain_series).__name__ == 'GainSeries'
+    assert gain_series.gain == 2.5 and np.array_equal(gain_series.data[:], np.arange(10.))
+    return t1 - t0
+
+
+if __name__ == '__main__':
+    # each step in its own process, get_class registers a generated class in the global type map of pynwb
+    if sys.argv[1:] == ['--write']:
+        write_file()
+        sys.exit()
+    if sys.argv[1:] == ['--generated']:
+        # type maps with generated classes are not picklable, they are kept in memory only
+        from pynwb import load_namespaces, get_class
+        load_namespaces(namespace_local)
+        get_class('GainSeries', 'ndx-cache-test')
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        read_file(cache_dir)
+        assert not os.path.exists(cache_dir) or not os.listdir(cache_dir)
+        print("generated classes in the global type map: read, namespace cache not written")
+        sys.exit()
+
+    if not os.path.exists(nwbfile_local):
+        subprocess.run([sys.executable, __file__, '--write'], check=True)
+    shutil.rmtree(cache_dir, ignore_errors=True)
+
+    # open: parse the cached specs, then copy the type map kept in memory
+    first = read_file(cache_dir)
+    times = [read_file(cache_dir) for _ in range(repeat)]
+    tm = next(iter(nwbhdf5zarrio._type_map_cache.values()))
+    copies = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        deepcopy(tm)
+        copies.append(time.perf_counter() - t0)
+    print(f"open, parsing namespaces: {first:.3f} s, cached: best of {repeat} {min(times):.3f} s, "
+          f"of which type map copy {min(copies):.3f} s")
+    assert min(times) < first/10, "cached namespaces are not faster to open than parsing them"
+
+    # pickle round trip of the type map in the namespace cache
+    cache_files = os.listdir(cache_dir)
+    assert len(cache_files) == 1, cache_files
+    with open(os.path.join(cache_dir, cache_files[0]), 'rb') as f:
+        assert pickle.load(f).namespace_catalog.namespaces == tm.namespace_catalog.namespaces
+    nwbhdf5zarrio._type_map_cache.clear()
+    print(f"open, namespaces read from {cache_dir}: {read_file(cache_dir):.3f} s")
+
+    subprocess.run([sys.executable, __file__, '--generated'], check=True)
+
+    # least recently opened specs are dropped from memory
+    for i in range(nwbhdf5zarrio.TYPE_MAP_CACHE_SIZE):
+        nwbhdf5zarrio._type_map_cache[f'digest {i}'] = tm
+    read_file()
+    assert len(nwbhdf5zarrio._type_map_cache) == nwbhdf5zarrio.TYPE_MAP_CACHE_SIZE
+    assert 'digest 0' not in nwbhdf5zarrio._type_map_cache
+    print("ok")
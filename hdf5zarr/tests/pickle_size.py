@@ -0,0 +1,45 @@
+import os
+import pickle
+import shutil
+import h5py
+import numpy as np
+from zarr.storage import ConsolidatedMetadataStore
+from hdf5zarr import HDF5Zarr, SQLiteMetadataStore
+
+# pickles of HDF5Zarr hold references to the stores, not the metadata, their size does not depend on the file
+file_sizes = {'small': 4, 'large': 400}
+data_dir = 'data/pickle_size'
+
+shutil.rmtree(data_dir, ignore_errors=True)
+os.makedirs(data_dir)
+sizes = {}
+for name, n_arrays in file_sizes.items():
+    filename = os.path.join(data_dir, f'{name}.h5')
+    with h5py.File(filename, mode='w') as hfile:
+        for i in range(n_arrays):
+            hfile.create_dataset(f'group_{i % 10}/array_{i}', data=np.arange(1000) + i, chunks=(100,))
+    for store_name, make_store in (('sqlite', lambda path: SQLiteMetadataStore(path + '.sqlite')),
+                                   ('directory', lambda path: path + '.zarr')):
+        for consolidated in (False, True):
+            for LRU in (False, True):
+                # same length of store paths for both files
+                path = os.path.join(data_dir, f'{name}_{store_name}_{consolidated:d}{LRU:d}')
+                hdf5_zarr = HDF5Zarr(filename, store=make_store(path), store_mode='w', LRU=LRU)
+                if consolidated:
+                    hdf5_zarr.consolidate_metadata()
+                data = pickle.dumps(hdf5_zarr)
+                sizes.setdefault(name, []).append(len(data))
+
+                hdf5_zarr_copy = pickle.loads(data)
+                zgroup = hdf5_zarr_copy.zgroup
+                assert isinstance(zgroup.store, ConsolidatedMetadataStore) == consolidated
+                i = n_arrays - 1
+                assert np.array_equal(zgroup[f'group_{i % 10}/array_{i}'][:], np.arange(1000) + i)
+                assert isinstance(hdf5_zarr_copy.chunk_store, type(hdf5_zarr.chunk_store))
+                hdf5_zarr.close()
+                hdf5_zarr_copy.close()
+
+for name, name_sizes in sizes.items():
+    print(f"{file_sizes[name]} arrays: pickle sizes {name_sizes} bytes")
+assert sizes['small'] == sizes['large'], sizes
+print("ok")
@@ -0,0 +1,50 @@
+import os
+from datetime import datetime, timezone
+import numpy as np
+import zarr
+from pynwb import NWBFile, NWBHDF5IO
+from pynwb.ecephys import ElectricalSeries
+from hdf5zarr import HDF5Zarr, NWBZARRHDF5IO
+
+# two sessions indexed at store paths of one store, read back with links and object references
+nwbfile_local = 'data/store_path_roundtrip.nwb'
+store_local = 'data/store_path_roundtrip.zarr'
+
+if not os.path.exists(nwbfile_local):
+    os.makedirs(os.path.dirname(nwbfile_local), exist_ok=True)
+    rng = np.random.default_rng(0)
+    nwb = NWBFile('store_path round trip', 'session', datetime(2020, 1, 1, tzinfo=timezone.utc))
+    device = nwb.create_device('probe')
+    electrode_group = nwb.create_electrode_group('shank0', 'shank', 'CA1', device)
+    for i in range(8):
+        nwb.add_electrode(x=float(i), y=0., z=0., imp=1., location='CA1', filtering='none', group=electrode_group)
+    region = nwb.create_electrode_table_region(list(range(8)), 'all electrodes')
+    nwb.add_acquisition(ElectricalSeries('raw', rng.normal(size=(10000, 8)).astype('float32'), region, rate=1000.))
+    for u in range(4):
+        nwb.add_unit(spike_times=np.sort(rng.uniform(0, 10, size=100)), electrodes=[u])
+    with NWBHDF5IO(nwbfile_local, 'w') as io:
+        io.write(nwb)
+
+store = zarr.DirectoryStore(store_local)
+for store_path in ('session_0', 'session_1'):
+    HDF5Zarr(nwbfile_local, store=store, store_path=store_path, store_mode='w')
+
+with NWBHDF5IO(nwbfile_local, 'r') as io:
+    expected = io.read()
+    raw_expected = expected.acquisition['raw'].data[:]
+    electrodes_expected = list(expected.acquisition['raw'].electrodes.data[:])
+
+for store_path in ('session_0', 'session_1'):
+    for consolidated in (False, True):
+        hdf5_zarr = HDF5Zarr(nwbfile_local, store=store, store_path=store_path, store_mode='r+')
+        zgroup = hdf5_zarr.consolidate_metadata() if consolidated else hdf5_zarr.zgroup
+        for lazy in (False, True):
+            io = NWBZARRHDF5IO(mode='r', file=zgroup, load_namespaces=True, lazy=lazy)
+            nwb = io.read()
+            raw = nwb.acquisition['raw']
+            assert np.array_equal(raw.data[:], raw_expected)
+            assert list(raw.electrodes.data[:]) == electrodes_expected
+            assert raw.electrodes.table is nwb.electrodes
+            assert nwb.electrode_groups['shank0'].device is nwb.devices['probe']
+            assert nwb.units['electrodes'][2].index.tolist() == [2]
+            print(f"{store_path} consolidated={consolidated} lazy={lazy}: ok")
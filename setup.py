@@ -17,6 +17,8 @@ setup(
     author_email="dsot@protonmail.com, ben.dichter@gmail.com",
     packages=find_packages(),
     install_requires=install_requires,
+    extras_require={'dask': ['dask[array]'], 'parquet': ['pandas', 'pyarrow']},
+    entry_points={'console_scripts': ['hdf5zarr-index=hdf5zarr.cli:main']},
     classifiers=['Operating System :: OS Independent',
                  'Development Status :: 3 - Alpha',
                  'License :: OSI Approved :: BSD License',